@@ -0,0 +1,109 @@
+import csv
+import os
+from datetime import date
+
+import storage
+from budgets import evaluate_budgets
+from locking import users_table_lock
+from passwords import hash_passwords_pooled
+
+# Operator commands across many accounts. Bulk changes rewrite the user
+# table once per batch rather than once per user, and the report scans
+# users in a process pool, REPORT_CHUNK_SIZE users per task.
+REPORT_WORKERS = int(os.environ.get("PFM_REPORT_WORKERS", os.cpu_count() or 2))
+REPORT_CHUNK_SIZE = 256
+
+
+def read_usernames(f):
+    # One username per line; blank lines and lines starting with "#" are
+    # skipped.
+    return [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+
+
+def read_password_resets(f):
+    # CSV rows of username,new_password. Returns {username: new_password}.
+    resets = {}
+    for row in csv.reader(f):
+        if not row or not row[0].strip() or row[0].lstrip().startswith("#"):
+            continue
+        if len(row) != 2 or not row[1]:
+            raise ValueError(f"expected username,new_password but got {','.join(row)!r}")
+        resets[row[0].strip()] = row[1]
+    return resets
+
+
+def bulk_delete(usernames, protected=()):
+    # Removes the accounts from the user table in one write, then deletes
+    # each user's data. Returns (deleted, skipped) lists of usernames.
+    with users_table_lock():
+        users = storage.load_users()
+        usernames = list(dict.fromkeys(usernames))
+        deleted = [u for u in usernames if u in users and u not in protected]
+        skipped = [u for u in usernames if u not in users or u in protected]
+        for username in deleted:
+            del users[username]
+        if deleted:
+            storage.save_users(users)
+    for username in deleted:
+        storage.delete_user_data(username)
+    return deleted, skipped
+
+
+def bulk_reset_passwords(resets, protected=()):
+    # resets is {username: new_password}. The hashes are computed in the
+    # password pool before the user table is locked, then written at once.
+    # Returns (reset, skipped) lists of usernames.
+    known = storage.load_users()
+    targets = [u for u in resets if u in known and u not in protected]
+    hashes = dict(zip(targets, hash_passwords_pooled([resets[u] for u in targets])))
+    with users_table_lock():
+        users = storage.load_users()
+        reset = [u for u in targets if u in users]
+        for username in reset:
+            users[username] = hashes[username]
+        if reset:
+            storage.save_users(users)
+    done = set(reset)
+    return reset, [u for u in resets if u not in done]
+
+
+def _user_report(username, today):
+    aggregates = storage.load_aggregates(username)
+    budgets = storage.load_budgets(username)
+    return {
+        "username": username,
+        "total_income": aggregates["total_income"],
+        "total_expense": aggregates["total_expense"],
+        "balance": aggregates["total_income"] - aggregates["total_expense"],
+        "entries": aggregates["income_count"] + aggregates["expense_count"],
+        "breaches": [result for result in evaluate_budgets(aggregates, budgets, today)
+                     if result["status"] == "exceeded"],
+    }
+
+
+def _report_chunk(usernames, today):
+    return [_user_report(username, today) for username in usernames]
+
+
+def user_report(usernames=None, workers=None, today=None):
+    # Totals and exceeded budgets for every user, in username order. Reads
+    # each user's aggregates document and only rebuilds it from the ledger
+    # when missing. workers=1 runs in this process.
+    if usernames is None:
+        usernames = storage.load_users()
+    usernames = sorted(usernames)
+    today = today or date.today()
+    workers = workers or REPORT_WORKERS
+    chunks = [usernames[i:i + REPORT_CHUNK_SIZE] for i in range(0, len(usernames), REPORT_CHUNK_SIZE)]
+    if workers <= 1 or len(chunks) <= 1:
+        return [row for chunk in chunks for row in _report_chunk(chunk, today)]
+
+    # Imported here: only the report needs it. "spawn" so that workers open
+    # their own storage handles instead of inheriting this process's
+    # SQLite connection and cache through fork.
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=context) as pool:
+        return [row for rows in pool.map(_report_chunk, chunks, [today] * len(chunks)) for row in rows]
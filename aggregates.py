@@ -0,0 +1,87 @@
+from datetime import date
+
+# Per-user running totals kept next to the ledger so the dashboard and the
+# CLI summary never have to rescan every entry. apply_entries() is O(1) per
+# entry; build_aggregates() recomputes the whole record from scratch.
+
+# Bumped whenever the record gains fields; stored records with another
+# schema are rebuilt on load.
+AGGREGATES_SCHEMA = 2
+
+
+def empty_aggregates():
+    return {
+        "schema": AGGREGATES_SCHEMA,
+        "total_income": 0.0,
+        "total_expense": 0.0,
+        "income_count": 0,
+        "expense_count": 0,
+        "categories": {},
+        "months": {},
+        "weeks": {},
+    }
+
+
+def _parse_date(date_str):
+    # Entry.from_dict keeps dates it cannot read as they are (hand-edited
+    # rows like "05/01/2024"); such entries count towards the totals but
+    # belong to no month or week.
+    if not isinstance(date_str, str) or len(date_str) != 10:
+        return None
+    try:
+        return date.fromisoformat(date_str)
+    except ValueError:
+        return None
+
+
+def month_key(date_str):
+    # Dates are stored as YYYY-MM-DD, so the month is just the prefix.
+    return date_str[:7] if _parse_date(date_str) else None
+
+
+def week_key(date_str):
+    # ISO week, e.g. "2024-W05".
+    day = _parse_date(date_str)
+    if day is None:
+        return None
+    year, week, _ = day.isocalendar()
+    return f"{year}-W{week:02d}"
+
+
+def _month(aggregates, entry):
+    key = month_key(entry.get("date"))
+    if key is None:
+        return None
+    months = aggregates["months"]
+    if key not in months:
+        months[key] = {"income": 0.0, "expense": 0.0, "categories": {}}
+    return months[key]
+
+
+def apply_entries(aggregates, income_entries=(), expense_entries=()):
+    for entry in income_entries:
+        aggregates["total_income"] += entry["amount"]
+        aggregates["income_count"] += 1
+        month = _month(aggregates, entry)
+        if month is not None:
+            month["income"] += entry["amount"]
+
+    categories = aggregates["categories"]
+    for entry in expense_entries:
+        category = entry.get("category", "Other")
+        aggregates["total_expense"] += entry["amount"]
+        aggregates["expense_count"] += 1
+        categories[category] = categories.get(category, 0) + entry["amount"]
+        month = _month(aggregates, entry)
+        if month is not None:
+            month["expense"] += entry["amount"]
+            month["categories"][category] = month["categories"].get(category, 0) + entry["amount"]
+        week = week_key(entry.get("date"))
+        if week is not None:
+            week_categories = aggregates["weeks"].setdefault(week, {})
+            week_categories[category] = week_categories.get(category, 0) + entry["amount"]
+    return aggregates
+
+
+def build_aggregates(income_entries, expense_entries):
+    return apply_entries(empty_aggregates(), income_entries, expense_entries)
@@ -0,0 +1,67 @@
+import numpy as np
+
+# Column-oriented view of a ledger for summaries and charts. Building it
+# walks the entries once; every query after that is a vectorized NumPy
+# reduction instead of a Python loop with a strptime per entry.
+
+# date(1970, 1, 1).toordinal(): day ordinals minus this are datetime64[D].
+_EPOCH_ORDINAL = 719163
+
+
+class ColumnarLedger:
+    def __init__(self, amounts, days, is_expense, category_codes, categories):
+        self.amounts = amounts              # float64
+        self.days = days                    # datetime64[D], NaT when undated
+        self.is_expense = is_expense        # bool
+        self.category_codes = category_codes  # int32, -1 for income
+        self.categories = categories        # code -> category name
+
+    @classmethod
+    def from_entries(cls, income_entries, expense_entries):
+        # Takes lists of entries.Entry, as returned by storage.load_data.
+        entries = income_entries + expense_entries
+        amounts = np.fromiter((e.amount for e in entries), dtype=np.float64, count=len(entries))
+        # Entries already hold day ordinals, so dates need no parsing at all.
+        ordinals = np.fromiter((e.day for e in entries), dtype=np.int64, count=len(entries))
+        days = (ordinals - _EPOCH_ORDINAL).astype("datetime64[D]")
+        days[ordinals == 0] = np.datetime64("NaT")
+        is_expense = np.zeros(len(entries), dtype=bool)
+        is_expense[len(income_entries):] = True
+
+        index = {}
+        codes = np.full(len(entries), -1, dtype=np.int32)
+        codes[len(income_entries):] = [index.setdefault(e.category, len(index)) for e in expense_entries]
+        return cls(amounts, days, is_expense, codes, list(index))
+
+    def totals(self):
+        total_expense = float(self.amounts[self.is_expense].sum())
+        return float(self.amounts.sum()) - total_expense, total_expense
+
+    def category_totals(self):
+        sums = np.bincount(self.category_codes[self.is_expense],
+                           weights=self.amounts[self.is_expense],
+                           minlength=len(self.categories))
+        return dict(zip(self.categories, sums.tolist()))
+
+    def monthly_totals(self):
+        # Returns (months as "YYYY-MM" strings, income per month, expense per
+        # month), ordered by month and skipping undated entries.
+        dated = ~np.isnat(self.days)
+        months = self.days[dated].astype("datetime64[M]")
+        unique_months, slots = np.unique(months, return_inverse=True)
+        amounts = self.amounts[dated]
+        is_expense = self.is_expense[dated]
+        income = np.bincount(slots, weights=np.where(is_expense, 0.0, amounts), minlength=len(unique_months))
+        expense = np.bincount(slots, weights=np.where(is_expense, amounts, 0.0), minlength=len(unique_months))
+        return np.datetime_as_string(unique_months, unit="M").tolist(), income, expense
+
+    def summary(self):
+        total_income, total_expense = self.totals()
+        months, income, expense = self.monthly_totals()
+        return {
+            "total_income": total_income,
+            "total_expense": total_expense,
+            "categories": self.category_totals(),
+            "months": {m: {"income": float(i), "expense": float(x)}
+                       for m, i, x in zip(months, income, expense)},
+        }
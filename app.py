@@ -1,55 +1,53 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
-import json
-import os
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, send_file, abort
+import concurrent.futures
 import hashlib
-from datetime import datetime
+import hmac
+import io
+from datetime import date, datetime
+
+import metrics
+import recurring
+import storage
+from batch import apply_ops
+from budgets import current_period_key, evaluate_budgets
+from categorize import learn_category, load_memo, save_rules, suggest_category
+from charts import CHART_FORMATS, CHARTS, render_chart
+from importer import import_statement
+from locking import users_table_lock
+from passwords import hash_password_pooled, needs_rehash, verify_password_pooled
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'  # Change this to a secure secret key!
+metrics.init_app(app)
 
-USERS_FILE = 'users.json'
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
 
 MASTER_USERNAME = "MasterVincent"
 MASTER_PASSWORD_HASH = hashlib.sha256("Master@210404".encode()).hexdigest()
 
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+def rehash_password(username, password, old_hash):
+    new_hash = hash_password_pooled(password)
+    with users_table_lock():
+        users = load_users()
+        # Skip if the password was changed while we were hashing.
+        if users.get(username) == old_hash:
+            users[username] = new_hash
+            save_users(users)
 
 def load_users():
-    if os.path.exists(USERS_FILE):
-        with open(USERS_FILE, 'r') as f:
-            return json.load(f)
-    return {}
+    return storage.load_users()
 
 def save_users(users):
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f, indent=4)
-
-def get_data_filenames(username):
-    return (f"{username}_income.json", f"{username}_expense.json", f"{username}_budgets.json")
-
-def load_data(username):
-    income_file, expense_file, _ = get_data_filenames(username)
-    if os.path.exists(income_file):
-        with open(income_file, 'r') as f:
-            income_entries = json.load(f)
-    else:
-        income_entries = []
-
-    if os.path.exists(expense_file):
-        with open(expense_file, 'r') as f:
-            expense_entries = json.load(f)
-    else:
-        expense_entries = []
-
-    return income_entries, expense_entries
-
-def save_data(username, income_entries, expense_entries):
-    income_file, expense_file, _ = get_data_filenames(username)
-    with open(income_file, 'w') as f:
-        json.dump(income_entries, f, indent=4)
-    with open(expense_file, 'w') as f:
-        json.dump(expense_entries, f, indent=4)
+    storage.save_users(users)
+
+@app.before_request
+def expand_recurring():
+    # Recurring entries that fell due since the user's last visit are
+    # written before any route reads their data.
+    username = session.get('username')
+    if username and not session.get('is_master'):
+        recurring.expand_due(username)
 
 # ROUTES BELOW
 
@@ -65,14 +63,26 @@ def login():
         username = request.form['username'].strip()
         password = request.form['password']
 
-        if username == MASTER_USERNAME and hash_password(password) == MASTER_PASSWORD_HASH:
-            session['username'] = username
-            session['is_master'] = True
-            flash('Logged in as Master Admin.', 'success')
-            return redirect(url_for('dashboard'))
-
-        users = load_users()
-        if username in users and users[username] == hash_password(password):
+        try:
+            if username == MASTER_USERNAME and verify_password_pooled(password, MASTER_PASSWORD_HASH):
+                session['username'] = username
+                session['is_master'] = True
+                flash('Logged in as Master Admin.', 'success')
+                return redirect(url_for('dashboard'))
+
+            stored_hash = load_users().get(username)
+            valid = stored_hash is not None and verify_password_pooled(password, stored_hash)
+        except concurrent.futures.TimeoutError:
+            flash('The server is busy. Please try again.', 'warning')
+            return render_template('login.html')
+
+        if valid and needs_rehash(stored_hash):
+            try:
+                rehash_password(username, password, stored_hash)
+            except concurrent.futures.TimeoutError:
+                pass  # The upgrade is optional; the next login retries it.
+
+        if valid:
             session['username'] = username
             session['is_master'] = False
             flash(f'Welcome, {username}!', 'success')
@@ -92,17 +102,23 @@ def register():
             flash('This username is reserved.', 'danger')
             return redirect(url_for('register'))
 
-        users = load_users()
-        if username in users:
-            flash('Username already exists.', 'danger')
-            return redirect(url_for('register'))
-
         if password != password_confirm:
             flash('Passwords do not match.', 'danger')
             return redirect(url_for('register'))
 
-        users[username] = hash_password(password)
-        save_users(users)
+        try:
+            password_hash = hash_password_pooled(password)
+        except concurrent.futures.TimeoutError:
+            flash('The server is busy. Please try again.', 'warning')
+            return redirect(url_for('register'))
+
+        with users_table_lock():
+            users = load_users()
+            if username in users:
+                flash('Username already exists.', 'danger')
+                return redirect(url_for('register'))
+            users[username] = password_hash
+            save_users(users)
         flash('Registration successful. Please log in.', 'success')
         return redirect(url_for('login'))
     return render_template('register.html')
@@ -120,17 +136,12 @@ def dashboard():
         return redirect(url_for('login'))
 
     username = session['username']
-    income_entries, expense_entries = load_data(username)
+    aggregates = storage.load_aggregates(username)
 
-    total_income = sum(entry['amount'] for entry in income_entries)
-    total_expense = sum(entry['amount'] for entry in expense_entries)
+    total_income = aggregates['total_income']
+    total_expense = aggregates['total_expense']
     balance = total_income - total_expense
-
-    # Simple expense categorization for display (optional enhancement later)
-    category_totals = {}
-    for entry in expense_entries:
-        category = entry.get('category', 'Other')
-        category_totals[category] = category_totals.get(category, 0) + entry['amount']
+    category_totals = aggregates['categories']
 
     return render_template('dashboard.html', username=username,
                            income=total_income,
@@ -159,13 +170,11 @@ def add_income():
             return redirect(url_for('add_income'))
 
         username = session['username']
-        income_entries, expense_entries = load_data(username)
-        income_entries.append({
+        storage.append_entries(username, income_entries=[{
             'source': source,
             'amount': amount,
             'date': datetime.now().strftime("%Y-%m-%d")
-        })
-        save_data(username, income_entries, expense_entries)
+        }])
         flash('Income added successfully!', 'success')
         return redirect(url_for('dashboard'))
 
@@ -184,8 +193,6 @@ def add_expense():
         if not description:
             flash('Description cannot be empty.', 'danger')
             return redirect(url_for('add_expense'))
-        if not category:
-            category = 'Other'
         try:
             amount = float(amount_str)
             if amount <= 0:
@@ -195,18 +202,221 @@ def add_expense():
             return redirect(url_for('add_expense'))
 
         username = session['username']
-        income_entries, expense_entries = load_data(username)
-        expense_entries.append({
+        suggested = suggest_category(description, storage.load_category_rules(username), load_memo(username))
+        if not category:
+            category = suggested
+        elif category != suggested:
+            learn_category(username, description, category)
+        storage.append_entries(username, expense_entries=[{
             'description': description,
             'category': category,
             'amount': amount,
             'date': datetime.now().strftime("%Y-%m-%d")
-        })
-        save_data(username, income_entries, expense_entries)
+        }])
         flash('Expense added successfully!', 'success')
         return redirect(url_for('dashboard'))
 
     return render_template('add_expense.html')
 
+@app.route('/import', methods=['GET', 'POST'])
+def import_transactions():
+    if 'username' not in session:
+        flash('Please log in first.', 'warning')
+        return redirect(url_for('login'))
+
+    if request.method == 'POST':
+        statement = request.files.get('statement')
+        if statement is None or not statement.filename:
+            flash('Choose a CSV or OFX file to import.', 'danger')
+            return redirect(url_for('import_transactions'))
+        # Read the upload as a text stream so large statements are never
+        # held in memory as one string.
+        stream = io.TextIOWrapper(statement.stream, encoding='utf-8-sig', errors='replace', newline='')
+        # Optional; only needed when no date in the file shows the order.
+        day_first = {'day-first': True, 'month-first': False}.get(request.form.get('date_order'))
+        try:
+            result = import_statement(session['username'], stream, statement.filename, day_first)
+        except ValueError as e:
+            flash(f'Could not import statement: {e}', 'danger')
+            return redirect(url_for('import_transactions'))
+        flash(f"Imported {result['income']} income and {result['expense']} expense entries "
+              f"({result['duplicates']} duplicates skipped, {result['invalid']} invalid rows).", 'success')
+        return redirect(url_for('dashboard'))
+
+    return render_template('import.html')
+
+@app.route('/api/transactions')
+def api_transactions():
+    if 'username' not in session:
+        return jsonify({'error': 'Authentication required.'}), 401
+
+    start = request.args.get('from') or None
+    end = request.args.get('to') or None
+    try:
+        for value in (start, end):
+            if value is not None:
+                # Dates compare as strings, so only the padded form will do.
+                if date.fromisoformat(value).isoformat() != value:
+                    raise ValueError
+        limit = int(request.args.get('limit', API_PAGE_SIZE))
+        if not 1 <= limit <= API_MAX_PAGE_SIZE:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': f'Dates must be YYYY-MM-DD and limit between 1 and {API_MAX_PAGE_SIZE}.'}), 400
+
+    try:
+        transactions, next_cursor = storage.query_entries(
+            session['username'], start, end,
+            category=request.args.get('category') or None,
+            cursor=request.args.get('cursor') or None,
+            limit=limit)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'transactions': transactions, 'next_cursor': next_cursor})
+
+@app.route('/api/entries', methods=['POST'])
+def api_entries():
+    if 'username' not in session:
+        return jsonify({'error': 'Authentication required.'}), 401
+
+    ops = request.get_json(silent=True)
+    if not isinstance(ops, list):
+        return jsonify({'error': 'Request body must be a JSON array of operations.'}), 400
+    try:
+        applied, results = apply_ops(session['username'], ops)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 413
+    return jsonify({'applied': applied, 'results': results}), 200 if applied else 422
+
+@app.route('/api/recurring', methods=['GET', 'POST'])
+def api_recurring():
+    if 'username' not in session:
+        return jsonify({'error': 'Authentication required.'}), 401
+
+    username = session['username']
+    if request.method == 'GET':
+        return jsonify({'rules': recurring.load_rules(username)})
+    rule = request.get_json(silent=True)
+    try:
+        rule_id, stored, written = recurring.add_rule(username, rule)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'id': rule_id, 'rule': stored, 'entries_added': written}), 201
+
+@app.route('/api/recurring/<rule_id>', methods=['DELETE'])
+def api_recurring_delete(rule_id):
+    if 'username' not in session:
+        return jsonify({'error': 'Authentication required.'}), 401
+    if not recurring.delete_rule(session['username'], rule_id):
+        return jsonify({'error': 'Rule not found.'}), 404
+    return '', 204
+
+@app.route('/api/category-rules', methods=['GET', 'PUT'])
+def api_category_rules():
+    if 'username' not in session:
+        return jsonify({'error': 'Authentication required.'}), 401
+
+    username = session['username']
+    if request.method == 'PUT':
+        try:
+            save_rules(username, request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    return jsonify({'rules': storage.load_category_rules(username)})
+
+@app.route('/api/changes')
+def api_changes():
+    if 'username' not in session:
+        return jsonify({'error': 'Authentication required.'}), 401
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({'error': 'since must be an integer.'}), 400
+    seq, changes, reset = storage.changes_since(session['username'], since)
+    return jsonify({'seq': seq, 'changes': changes, 'reset': reset})
+
+@app.route('/api/dashboard')
+def api_dashboard():
+    if 'username' not in session:
+        return jsonify({'error': 'Authentication required.'}), 401
+
+    username = session['username']
+    # The change sequence is cached and revalidated with a stat (or one
+    # indexed row on SQLite), so an unchanged dashboard is answered without
+    # loading data.
+    # Budget spending is per month or week, so the ETag moves on with them.
+    today = datetime.now().date()
+    etag = (f'{username}-{storage.change_seq(username)}'
+            f'-{current_period_key("monthly", today)}-{current_period_key("weekly", today)}')
+    if request.if_none_match.contains(etag):
+        return '', 304
+
+    aggregates = storage.load_aggregates(username)
+    response = jsonify({
+        'income': aggregates['total_income'],
+        'expense': aggregates['total_expense'],
+        'balance': aggregates['total_income'] - aggregates['total_expense'],
+        'category_totals': aggregates['categories'],
+        'budgets': evaluate_budgets(aggregates, storage.load_budgets(username), today),
+    })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/api/forecast')
+def api_forecast():
+    if 'username' not in session:
+        return jsonify({'error': 'Authentication required.'}), 401
+    # Deferred so the app still runs without NumPy.
+    from forecast import DEFAULT_HORIZON, DEFAULT_METHOD, forecast
+
+    try:
+        months = int(request.args.get('months', DEFAULT_HORIZON))
+    except ValueError:
+        return jsonify({'error': 'months must be an integer.'}), 400
+    method = request.args.get('method', DEFAULT_METHOD)
+
+    username = session['username']
+    # Like the dashboard, but the forecast also moves on when the month turns.
+    etag = f'{username}-{storage.change_seq(username)}-{datetime.now():%Y-%m}-{months}-{method}'
+    if request.if_none_match.contains(etag):
+        return '', 304
+    try:
+        result = forecast(username, months, method)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    response = jsonify(result)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.route('/charts/<chart>.<fmt>')
+def chart_image(chart, fmt):
+    if 'username' not in session:
+        flash('Please log in first.', 'warning')
+        return redirect(url_for('login'))
+    if chart not in CHARTS or fmt not in CHART_FORMATS:
+        abort(404)
+
+    path, key = render_chart(chart, fmt, storage.load_aggregates(session['username']))
+    return send_file(path, mimetype=CHART_FORMATS[fmt], etag=key, max_age=0)
+
+@app.route('/cache_stats')
+def cache_stats():
+    if not session.get('is_master'):
+        flash('Admin access required.', 'danger')
+        return redirect(url_for('login'))
+    return jsonify(storage.cache_stats())
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Prometheus scrape target; only exists when PFM_METRICS=1.
+    if not metrics.ENABLED:
+        abort(404)
+    if metrics.METRICS_TOKEN and not hmac.compare_digest(
+            request.headers.get('Authorization', ''), f'Bearer {metrics.METRICS_TOKEN}'):
+        abort(401)
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,106 @@
+from datetime import datetime
+
+import storage
+from budgets import DEFAULT_PERIOD, PERIODS, make_budget
+from categorize import load_memo, suggest_category
+from locking import user_lock
+
+# Bulk entry operations shared by the JSON API and the CLI. Each op is a
+# dict with a "type" of "income", "expense" or "budget"; a batch is checked
+# in full before anything is written, then committed in one storage batch.
+MAX_BATCH_OPS = 1000
+
+
+def _amount(op):
+    amount = op.get("amount")
+    if isinstance(amount, bool) or not isinstance(amount, (int, float, str)):
+        raise ValueError("amount must be a positive number")
+    try:
+        amount = float(amount)
+    except ValueError:
+        raise ValueError("amount must be a positive number")
+    if not amount > 0 or amount == float("inf"):
+        raise ValueError("amount must be a positive number")
+    return amount
+
+
+def _text(op, field, required=True):
+    value = op.get(field)
+    if value is None and not required:
+        return ""
+    if not isinstance(value, str) or (required and not value.strip()):
+        raise ValueError(f"{field} cannot be empty")
+    return value.strip()
+
+
+def _date(op):
+    value = op.get("date")
+    if value is None:
+        return datetime.now().strftime("%Y-%m-%d")
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except (TypeError, ValueError):
+        raise ValueError("date must be YYYY-MM-DD")
+
+
+def _period(op):
+    period = op.get("period") or DEFAULT_PERIOD
+    if period not in PERIODS:
+        raise ValueError(f"period must be one of {', '.join(PERIODS)}")
+    return period
+
+
+def validate_op(op, rules=None, memo=None):
+    # Returns (type, normalized payload) or raises ValueError.
+    if not isinstance(op, dict):
+        raise ValueError("each operation must be an object")
+    op_type = op.get("type")
+    if op_type == "income":
+        return "income", {"source": _text(op, "source"), "amount": _amount(op), "date": _date(op)}
+    if op_type == "expense":
+        description = _text(op, "description")
+        category = _text(op, "category", required=False) or suggest_category(description, rules, memo)
+        return "expense", {
+            "description": description,
+            "category": category,
+            "amount": _amount(op),
+            "date": _date(op),
+        }
+    if op_type == "budget":
+        return "budget", {
+            "category": _text(op, "category"),
+            "amount": _amount(op),
+            "period": _period(op),
+        }
+    raise ValueError("type must be income, expense or budget")
+
+
+def apply_ops(username, ops, max_ops=MAX_BATCH_OPS):
+    # Returns (applied, results) where results has one {"index", "status"}
+    # dict per op, plus "error" for rejected ones. Nothing is written unless
+    # every op is valid. max_ops=None lifts the size limit.
+    ops = list(ops)
+    if max_ops is not None and len(ops) > max_ops:
+        raise ValueError(f"at most {max_ops} operations per batch")
+    with user_lock(username):
+        rules = storage.load_category_rules(username)
+        memo = load_memo(username)
+        validated, results = [], []
+        for index, op in enumerate(ops):
+            try:
+                validated.append(validate_op(op, rules, memo))
+                results.append({"index": index, "status": "ok"})
+            except ValueError as e:
+                results.append({"index": index, "status": "error", "error": str(e)})
+        if any(result["status"] == "error" for result in results):
+            for result in results:
+                if result["status"] == "ok":
+                    result["status"] = "skipped"
+            return False, results
+
+        income = [payload for op_type, payload in validated if op_type == "income"]
+        expense = [payload for op_type, payload in validated if op_type == "expense"]
+        budgets = {payload["category"]: make_budget(payload["amount"], payload["period"])
+                   for op_type, payload in validated if op_type == "budget"}
+        storage.apply_batch(username, income, expense, budgets)
+        return True, results
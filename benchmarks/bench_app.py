@@ -0,0 +1,133 @@
+"""Load driver for the Flask routes, through the test client.
+
+Generates synthetic users in a scratch data directory and sends a weighted
+mix of requests to app.py from --threads concurrent clients, each signed
+in as its own user, for --requests requests in total. Reports per route
+and overall: calls, ops/s (wall clock), p50 and p99. Routes that render
+templates are left out; the repository does not ship them.
+
+Usage: python benchmarks/bench_app.py [--users 20] [--entries 2000]
+       [--threads 4] [--requests 2000] [--mix api_dashboard=5,login=1]
+       [--json out.json] [--compare base.json]
+"""
+import argparse
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import harness
+
+DEFAULT_MIX = "api_dashboard=8,api_dashboard_etag=4,api_transactions=6,api_changes=4,api_entries=2,chart=1,login=1"
+
+
+def build_routes(start_date):
+    # name -> function(client, state) returning the response. state holds
+    # per-client values such as the last ETag seen.
+    def api_dashboard(client, state):
+        return client.get("/api/dashboard")
+
+    def api_dashboard_etag(client, state):
+        response = client.get("/api/dashboard", headers={"If-None-Match": state.get("etag", "")})
+        if response.status_code == 200:
+            state["etag"] = response.headers.get("ETag", "").strip('"')
+        return response
+
+    def api_transactions(client, state):
+        cursor = state.pop("cursor", None)
+        response = client.get("/api/transactions", query_string={"limit": 50, "cursor": cursor or ""})
+        if response.status_code == 200 and response.json["next_cursor"]:
+            state["cursor"] = response.json["next_cursor"]
+        return response
+
+    def api_changes(client, state):
+        response = client.get("/api/changes", query_string={"since": state.get("seq", 0)})
+        if response.status_code == 200:
+            state["seq"] = response.json["seq"]
+        return response
+
+    def api_entries(client, state):
+        return client.post("/api/entries", json=[
+            {"type": "expense", "description": "Coffee Downtown", "amount": 3.5, "date": start_date},
+            {"type": "income", "source": "Refund", "amount": 12.0, "date": start_date},
+        ])
+
+    def chart(client, state):
+        return client.get("/charts/expenses_by_category.png")
+
+    def login(client, state):
+        return client.post("/login", data={"username": state["username"], "password": harness.PASSWORD})
+
+    return {name: func for name, func in locals().items() if callable(func)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    harness.add_data_arguments(parser)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=2000, help="Total requests (default: %(default)s).")
+    parser.add_argument("--mix", type=harness.parse_weights, default=DEFAULT_MIX,
+                        help="Route weights (default: %(default)s).")
+    harness.add_output_arguments(parser)
+    args = parser.parse_args()
+
+    harness.use_scratch_dir(args.storage)
+    from app import app
+
+    usernames = harness.populate(args)
+    routes = build_routes(args.start.isoformat())
+    mix = [(name, weight) for name, weight in args.mix if name in routes]
+    unknown = [name for name, _ in args.mix if name not in routes]
+    if unknown:
+        parser.error(f"unknown routes {', '.join(unknown)}; choose from {', '.join(routes)}")
+    try:
+        import matplotlib  # noqa: F401
+    except ImportError:
+        print("matplotlib not installed; skipping chart.")
+        mix = [(name, weight) for name, weight in mix if name != "chart"]
+
+    timings = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+
+    def client_loop(index, count):
+        rng = random.Random(args.seed + index)
+        client = app.test_client()
+        state = {"username": usernames[index % len(usernames)]}
+        with client.session_transaction() as session:
+            session["username"] = state["username"]
+        names = [name for name, _ in mix]
+        weights = [weight for _, weight in mix]
+        local = defaultdict(list)
+        failed = defaultdict(int)
+        for _ in range(count):
+            name = rng.choices(names, weights)[0]
+            start = time.perf_counter()
+            response = routes[name](client, state)
+            local[name].append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                failed[name] += 1
+        with lock:
+            for name, values in local.items():
+                timings[name].extend(values)
+            for name, count in failed.items():
+                errors[name] += count
+
+    per_thread = [args.requests // args.threads + (i < args.requests % args.threads) for i in range(args.threads)]
+    print(f"{args.users} users x {args.entries} entries, {args.storage} storage, {args.threads} threads\n")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(client_loop, range(args.threads), per_thread))
+    wall = time.perf_counter() - start
+
+    # Per route, ops/s is that route's share of the mix's throughput.
+    results = [harness.summarize(name, values, wall) for name, values in sorted(timings.items())]
+    results.append(harness.summarize("all routes", [t for values in timings.values() for t in values], wall))
+    harness.report(results, args)
+    for name, count in sorted(errors.items()):
+        print(f"{name}: {count} error response(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Latency and throughput of the hot paths, on synthetic users.
+
+Generates --users users with --entries entries each in a scratch data
+directory, then times: load_data from disk and from the cache, save_data,
+a single append, the dashboard aggregation, a full aggregate rebuild,
+suggest_category, the CLI's view_summary, monthly grouping (NumPy) and
+password verification for login. Each case reports calls, ops/s, p50 and
+p99. Save a run with --json and compare a later one with --compare.
+
+Usage: python benchmarks/bench_hotpaths.py [--users 20] [--entries 2000]
+       [--storage json|log|sqlite] [--iterations 200] [--json out.json]
+"""
+import argparse
+import contextlib
+import importlib.util
+import io
+import os
+import random
+
+import harness
+
+
+def load_cli():
+    # "finance project.py" cannot be imported by name.
+    spec = importlib.util.spec_from_file_location("finance_cli", os.path.join(harness.ROOT, "finance project.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    harness.add_data_arguments(parser)
+    parser.add_argument("--iterations", type=int, default=200, help="Calls per case (login: a tenth).")
+    harness.add_output_arguments(parser)
+    args = parser.parse_args()
+
+    harness.use_scratch_dir(args.storage)
+    import storage
+    from aggregates import build_aggregates
+    from budgets import evaluate_budgets
+    from categorize import suggest_category
+    from passwords import verify_password
+
+    usernames = harness.populate(args)
+    rng = random.Random(args.seed)
+    pick = lambda i: usernames[i % len(usernames)]  # noqa: E731
+    descriptions = [entry["description"] for entry in harness.make_ledger(
+        rng, 500, args.categories, args.start, args.days, income_share=0)[1]]
+    ledgers = {username: storage.load_data(username) for username in usernames}
+    stored_hash = storage.load_users()[usernames[0]]
+    cli = load_cli()
+    n = args.iterations
+
+    def cold(i):
+        storage._cache.clear()
+        return pick(i)
+
+    def warm(i):
+        storage.load_data(pick(i))
+        return pick(i)
+
+    def dashboard(username):
+        aggregates = storage.load_aggregates(username)
+        evaluate_budgets(aggregates, storage.load_budgets(username))
+
+    def append(username):
+        storage.append_entries(username, expense_entries=[
+            {"description": "Coffee", "category": "Food", "amount": 3.5, "date": args.start.isoformat()}])
+
+    def view_summary(username):
+        with contextlib.redirect_stdout(io.StringIO()):
+            cli.view_summary(storage.load_aggregates(username), storage.load_budgets(username))
+
+    cases = [
+        ("load_data cold", lambda username: storage.load_data(username), n, cold),
+        ("load_data cached", lambda username: storage.load_data(username), n, warm),
+        ("save_data", lambda username: storage.save_data(username, *ledgers[username]), max(1, n // 4), pick),
+        ("append_entries", append, n, pick),
+        ("dashboard aggregation", dashboard, n, pick),
+        ("build_aggregates", lambda username: build_aggregates(*ledgers[username]), max(1, n // 4), pick),
+        ("suggest_category", lambda i: suggest_category(descriptions[i % len(descriptions)]), n * 10, None),
+        ("view_summary", view_summary, n, pick),
+    ]
+    try:
+        from analytics import ColumnarLedger
+
+        cases.append(("monthly grouping", lambda username: ColumnarLedger.from_entries(
+            *ledgers[username]).monthly_totals(), max(1, n // 4), pick))
+    except ImportError:
+        print("NumPy not installed; skipping monthly grouping.")
+    cases.append(("login verify_password", lambda i: verify_password(harness.PASSWORD, stored_hash),
+                  max(1, n // 10), None))
+
+    print(f"{args.users} users x {args.entries} entries, {args.storage} storage\n")
+    results = [harness.summarize(name, harness.measure(func, iterations, setup))
+               for name, func, iterations, setup in cases]
+    harness.report(results, args)
+
+
+if __name__ == "__main__":
+    main()
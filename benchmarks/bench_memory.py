@@ -0,0 +1,59 @@
+"""Memory held per cached ledger entry: JSON dicts vs entries.Entry.
+
+Builds a synthetic ledger, parses it from JSON the way the storage backends
+do, and measures with tracemalloc the bytes retained by the parsed dicts and
+by the same ledger converted to Entry objects (what storage.load_data keeps
+in its cache). Also checks that every entry round-trips to identical JSON.
+
+Usage: python benchmarks/bench_memory.py [--entries 100000]
+"""
+import argparse
+import gc
+import json
+import random
+import tracemalloc
+from datetime import date
+
+import harness
+from entries import from_dicts
+
+
+def make_ledger_json(count, seed=1):
+    income, expense = harness.make_ledger(random.Random(seed), count, harness.parse_weights("Food,Travel,Bills,Other"),
+                                          date(2020, 1, 1), 5 * 365)
+    return json.dumps(income), json.dumps(expense)
+
+
+def retained_bytes(build):
+    # Bytes still allocated after build() returns, with its result alive.
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--entries", type=int, default=100_000)
+    args = parser.parse_args()
+
+    income_json, expense_json = make_ledger_json(args.entries)
+    dict_bytes, dicts = retained_bytes(lambda: (json.loads(income_json), json.loads(expense_json)))
+    entry_bytes, compact = retained_bytes(
+        lambda: (from_dicts("income", json.loads(income_json)), from_dicts("expense", json.loads(expense_json))))
+
+    for records, entries in zip(dicts, compact):
+        assert [e.to_dict() for e in entries] == records, "Entry round-trip changed the data"
+
+    total = sum(len(records) for records in dicts)
+    print(f"entries: {total}")
+    print(f"dicts:   {dict_bytes / total:8.1f} bytes/entry")
+    print(f"Entry:   {entry_bytes / total:8.1f} bytes/entry  ({dict_bytes / entry_bytes:.1f}x smaller)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Logins per second per core for each scrypt cost setting.
+
+Usage: python benchmarks/bench_passwords.py [--seconds 2] [--workers N]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import passwords  # noqa: E402
+
+COSTS = [2 ** 12, 2 ** 13, 2 ** 14, 2 ** 15, 2 ** 16]
+
+
+def logins_per_second(stored, workers, seconds):
+    deadline = time.perf_counter() + seconds
+
+    def worker():
+        count = 0
+        while time.perf_counter() < deadline:
+            passwords.verify_password("correct horse", stored)
+            count += 1
+        return count
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        total = sum(pool.map(lambda _: worker(), range(workers)))
+    return total / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=2.0)
+    parser.add_argument("--workers", type=int, default=passwords.HASH_WORKERS)
+    args = parser.parse_args()
+
+    print(f"{'n':>8} {'r':>3} {'p':>3} {'mem MiB':>8} {'ms/login':>9} {'logins/s/core':>14} "
+          f"{'logins/s x' + str(args.workers):>15}")
+    legacy = passwords.hashlib.sha256(b"correct horse").hexdigest()
+    rate = logins_per_second(legacy, 1, args.seconds)
+    print(f"{'sha256':>8} {'-':>3} {'-':>3} {'-':>8} {1000 / rate:>9.3f} {rate:>14.0f} {'-':>15}")
+    for n in COSTS:
+        stored = passwords.hash_password("correct horse", n=n)
+        single = logins_per_second(stored, 1, args.seconds)
+        pooled = logins_per_second(stored, args.workers, args.seconds)
+        memory = 128 * passwords.SCRYPT_R * n / 2 ** 20
+        print(f"{n:>8} {passwords.SCRYPT_R:>3} {passwords.SCRYPT_P:>3} {memory:>8.0f} {1000 / single:>9.1f} "
+              f"{single:>14.1f} {pooled:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
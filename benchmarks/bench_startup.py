@@ -0,0 +1,79 @@
+"""CLI startup import cost, measured with `python -X importtime`.
+
+Imports "finance project.py" without running its menu, several times, and
+reports the median total import time and the heaviest imports. Exits with
+status 1 if a module that should stay deferred is imported at startup or
+if the median exceeds --max-ms, so it can gate regressions in CI.
+
+Usage: python benchmarks/bench_startup.py [--runs 5] [--max-ms 150]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLI_PATH = os.path.join(ROOT, "finance project.py")
+
+# Only needed by the visualization menu options.
+DEFERRED_MODULES = ("matplotlib", "numpy", "analytics")
+
+LOAD_CLI = (
+    "import importlib.util, sys; sys.path.insert(0, {root!r}); "
+    "spec = importlib.util.spec_from_file_location('finance_cli', {path!r}); "
+    "spec.loader.exec_module(importlib.util.module_from_spec(spec))"
+)
+
+
+def measure_once():
+    # Returns {module: cumulative microseconds} for one cold interpreter.
+    code = LOAD_CLI.format(root=ROOT, path=CLI_PATH)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                            capture_output=True, text=True, check=True)
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        if cumulative_us.strip().isdigit():
+            # Drop the separator space but keep the nesting indentation.
+            cumulative[name[1:]] = int(cumulative_us)
+    return cumulative
+
+
+def top_level_total(cumulative):
+    return sum(us for name, us in cumulative.items() if not name.startswith(" "))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-ms", type=float, default=150.0)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    runs = [measure_once() for _ in range(args.runs)]
+    totals_ms = [top_level_total(run) / 1000 for run in runs]
+    median_ms = statistics.median(totals_ms)
+    last = runs[-1]
+
+    print(f"CLI import time over {args.runs} runs: median {median_ms:.1f} ms "
+          f"(min {min(totals_ms):.1f}, max {max(totals_ms):.1f})")
+    print("\nHeaviest imports (cumulative, last run):")
+    for name, us in sorted(last.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {us / 1000:8.1f} ms  {name.strip()}")
+
+    failed = False
+    eager = sorted({name.strip().split(".")[0] for name in last} & set(DEFERRED_MODULES))
+    if eager:
+        print(f"\nFAIL: imported at startup but should be deferred: {', '.join(eager)}")
+        failed = True
+    if median_ms > args.max_ms:
+        print(f"\nFAIL: median {median_ms:.1f} ms exceeds budget of {args.max_ms:.1f} ms")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""Shared pieces for the benchmark scripts: synthetic data and timing.
+
+Not a benchmark itself. A script calls use_scratch_dir() before importing
+storage (which reads its PFM_* settings at import time), generates users
+with populate(), times calls with measure() and reports with report().
+Results can be saved with --json and compared against an earlier run with
+--compare, so a change can be measured before and after.
+"""
+import atexit
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# use_scratch_dir() changes directory; --json and --compare paths are
+# relative to where the script was started.
+START_DIR = os.getcwd()
+
+PASSWORD = "correct horse"
+INCOME_SOURCES = ["Salary", "Freelance", "Dividends", "Rent income", "Refund"]
+MERCHANTS = ["Downtown", "Airport", "Online", "Corner Store", "Mall", "Station"]
+# Descriptions for categories without built-in keywords, so they fall
+# through to "Other" the way hand-typed expenses do.
+PLAIN_DESCRIPTIONS = ["Books", "Gift", "Gym membership", "Haircut", "Movie tickets", "Stationery"]
+
+
+def parse_weights(spec):
+    # "Food=4,Travel=2,Other=1" -> [("Food", 4.0), ("Travel", 2.0), ("Other", 1.0)]
+    weights = []
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if not name.strip():
+            raise ValueError(f"bad category weight {part!r}")
+        weights.append((name.strip(), float(weight or 1)))
+    return weights
+
+
+def add_data_arguments(parser):
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--entries", type=int, default=2000, help="Entries per user (default: %(default)s).")
+    parser.add_argument("--categories", type=parse_weights, default="Food=4,Travel=2,Bills=2,Other=1",
+                        help="Expense category weights (default: %(default)s).")
+    parser.add_argument("--income-share", type=float, default=0.2, help="Share of entries that are income.")
+    parser.add_argument("--start", type=date.fromisoformat, default=date(2022, 1, 1))
+    parser.add_argument("--days", type=int, default=3 * 365, help="Date span from --start (default: %(default)s).")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--storage", choices=("json", "log", "sqlite"), default=os.environ.get("PFM_STORAGE", "json"))
+
+
+def add_output_arguments(parser):
+    parser.add_argument("--json", metavar="PATH", help="Also write the results to PATH as JSON.")
+    parser.add_argument("--compare", metavar="PATH", help="Show the change against results saved with --json.")
+
+
+def use_scratch_dir(storage_mode):
+    # Points every PFM_* path at a fresh temporary directory, removed at
+    # exit, and works from inside it.
+    directory = tempfile.mkdtemp(prefix="pfm-bench-")
+    atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    os.environ.update({
+        "PFM_STORAGE": storage_mode,
+        "PFM_DATA_DIR": os.path.join(directory, "data"),
+        "PFM_LEGACY_DATA_DIR": directory,
+        "PFM_LOCK_DIR": os.path.join(directory, ".locks"),
+        "PFM_SQLITE_PATH": os.path.join(directory, "finance.db"),
+        "PFM_CHART_CACHE_DIR": os.path.join(directory, "chart_cache"),
+        "PFM_PROFILE_DIR": os.path.join(directory, "profiles"),
+    })
+    os.chdir(directory)
+    return directory
+
+
+def make_ledger(rng, entries, categories, start, days, income_share=0.2):
+    # Returns (income, expense) lists of entry dicts in date order.
+    from categorize import CATEGORY_KEYWORDS
+
+    names = [name for name, _ in categories]
+    weights = [weight for _, weight in categories]
+    income, expense = [], []
+    for _ in range(entries):
+        day = (start + timedelta(days=rng.randrange(days))).isoformat()
+        if rng.random() < income_share:
+            income.append({"source": rng.choice(INCOME_SOURCES), "amount": round(rng.uniform(100, 5000), 2),
+                           "date": day})
+            continue
+        category = rng.choices(names, weights)[0]
+        keyword = rng.choice(CATEGORY_KEYWORDS.get(category) or PLAIN_DESCRIPTIONS)
+        expense.append({"description": f"{keyword.capitalize()} {rng.choice(MERCHANTS)}", "category": category,
+                        "amount": round(rng.uniform(1, 500), 2), "date": day})
+    income.sort(key=lambda entry: entry["date"])
+    expense.sort(key=lambda entry: entry["date"])
+    return income, expense
+
+
+def populate(args):
+    # Creates args.users users sharing PASSWORD, each with a ledger and a
+    # monthly budget per category. Returns the usernames.
+    import storage
+    from budgets import make_budget
+    from passwords import hash_password
+
+    rng = random.Random(args.seed)
+    usernames = [f"user{i:05d}" for i in range(args.users)]
+    stored = hash_password(PASSWORD)
+    storage.save_users({username: stored for username in usernames})
+    for username in usernames:
+        income, expense = make_ledger(rng, args.entries, args.categories, args.start, args.days, args.income_share)
+        storage.save_data(username, income, expense)
+        storage.save_budgets(username, {name: make_budget(round(rng.uniform(200, 2000), 2))
+                                        for name, _ in args.categories})
+    return usernames
+
+
+def measure(func, iterations, setup=None):
+    # Per-call wall times in seconds. setup, if given, runs untimed before
+    # each call and its result is passed to func.
+    timings = []
+    for i in range(iterations):
+        value = setup(i) if setup is not None else i
+        start = time.perf_counter()
+        func(value)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def percentile(sorted_values, q):
+    # Nearest-rank percentile of an ascending list.
+    rank = math.ceil(q / 100 * len(sorted_values))
+    return sorted_values[max(0, min(len(sorted_values), rank) - 1)]
+
+
+def summarize(name, timings, wall=None):
+    # wall is the elapsed time for concurrent runs, where throughput is not
+    # simply calls / sum of latencies.
+    ordered = sorted(timings)
+    elapsed = wall if wall is not None else sum(ordered)
+    return {
+        "name": name,
+        "calls": len(ordered),
+        "ops_per_sec": len(ordered) / elapsed if elapsed else float("inf"),
+        "p50_ms": percentile(ordered, 50) * 1000,
+        "p99_ms": percentile(ordered, 99) * 1000,
+    }
+
+
+def report(results, args):
+    baseline = {}
+    if getattr(args, "compare", None):
+        with open(os.path.join(START_DIR, args.compare)) as f:
+            baseline = {result["name"]: result for result in json.load(f)["results"]}
+
+    header = f"{'case':<28} {'calls':>7} {'ops/s':>11} {'p50 ms':>9} {'p99 ms':>9}"
+    print(header + (f" {'vs base p50':>12}" if baseline else ""))
+    for result in results:
+        line = (f"{result['name']:<28} {result['calls']:>7} {result['ops_per_sec']:>11.1f} "
+                f"{result['p50_ms']:>9.3f} {result['p99_ms']:>9.3f}")
+        before = baseline.get(result["name"])
+        if before and before["p50_ms"]:
+            line += f" {(result['p50_ms'] / before['p50_ms'] - 1) * 100:>+11.1f}%"
+        print(line)
+
+    if getattr(args, "json", None):
+        settings = {key: value for key, value in vars(args).items() if key not in ("json", "compare")}
+        with open(os.path.join(START_DIR, args.json), "w") as f:
+            json.dump({"settings": settings, "results": results}, f, indent=2, default=str)
@@ -0,0 +1,78 @@
+from datetime import date
+
+import storage
+from aggregates import month_key, week_key
+
+# A budget is stored as {"amount": limit, "period": period}. Budgets saved
+# before periods existed are bare numbers and keep their old meaning of a
+# limit on all spending ever ("total"). Spending per period is read from
+# the per-month and per-week category sums in the user's aggregates, so a
+# check is a couple of dict lookups however long the history is.
+PERIODS = ("monthly", "weekly", "total")
+DEFAULT_PERIOD = "monthly"
+WARNING_RATIO = 0.9
+
+
+def make_budget(amount, period=DEFAULT_PERIOD):
+    if period not in PERIODS:
+        raise ValueError(f"period must be one of {', '.join(PERIODS)}")
+    return {"amount": amount, "period": period}
+
+
+def normalize_budget(budget):
+    if isinstance(budget, dict):
+        return budget
+    return {"amount": budget, "period": "total"}
+
+
+def current_period_key(period, today=None):
+    today = (today or date.today()).isoformat()
+    if period == "monthly":
+        return month_key(today)
+    if period == "weekly":
+        return week_key(today)
+    return None
+
+
+def spent_in_period(aggregates, category, period, today=None):
+    key = current_period_key(period, today)
+    if period == "monthly":
+        return aggregates["months"].get(key, {}).get("categories", {}).get(category, 0)
+    if period == "weekly":
+        return aggregates["weeks"].get(key, {}).get(category, 0)
+    return aggregates["categories"].get(category, 0)
+
+
+def budget_status(spent, limit):
+    if spent >= limit:
+        return "exceeded"
+    if spent >= WARNING_RATIO * limit:
+        return "nearing"
+    return "ok"
+
+
+def evaluate_budget(aggregates, category, budget, today=None):
+    budget = normalize_budget(budget)
+    spent = spent_in_period(aggregates, category, budget["period"], today)
+    return {
+        "category": category,
+        "amount": budget["amount"],
+        "period": budget["period"],
+        "spent": spent,
+        "status": budget_status(spent, budget["amount"]),
+    }
+
+
+def evaluate_budgets(aggregates, budgets, today=None):
+    return [evaluate_budget(aggregates, category, budget, today) for category, budget in budgets.items()]
+
+
+def evaluate_all_budgets(today=None, usernames=None):
+    # One pass over every user for nightly alerting: per user it reads the
+    # budgets and aggregates documents only, never the ledger. Yields
+    # (username, evaluations) for users that have budgets.
+    today = today or date.today()
+    for username in usernames if usernames is not None else storage.load_users():
+        budgets = storage.load_budgets(username)
+        if budgets:
+            yield username, evaluate_budgets(storage.load_aggregates(username), budgets, today)
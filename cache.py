@@ -0,0 +1,84 @@
+import sys
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    # Bounded by both item count and an estimate of the bytes held. Each
+    # value is stored with the signature it was loaded under; a lookup with
+    # a different signature counts as a miss and drops the stale value.
+
+    def __init__(self, max_items, max_bytes):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, signature):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None and item[0] == signature:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item is not None:
+                self._remove(key)
+                self.invalidations += 1
+            self.misses += 1
+            return None
+
+    def put(self, key, signature, value, nbytes):
+        if self.max_items <= 0 or nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+            self._items[key] = (signature, value, nbytes)
+            self.current_bytes += nbytes
+            while len(self._items) > self.max_items or self.current_bytes > self.max_bytes:
+                self._remove(next(iter(self._items)))
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "items": len(self._items),
+                "bytes": self.current_bytes,
+                "max_items": self.max_items,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, key):
+        _, _, nbytes = self._items.pop(key)
+        self.current_bytes -= nbytes
+
+
+def estimate_size(records):
+    # Rough in-memory footprint of a list of flat dicts (or a flat dict).
+    if isinstance(records, dict):
+        records = [records]
+    size = sys.getsizeof(records)
+    for record in records:
+        size += sys.getsizeof(record)
+        for key, value in record.items():
+            size += sys.getsizeof(key) + sys.getsizeof(value)
+    return size
@@ -0,0 +1,186 @@
+import re
+from collections import OrderedDict
+from functools import lru_cache
+
+import storage
+from locking import user_lock
+
+# Keywords for auto-categorizing expenses
+CATEGORY_KEYWORDS = {
+    "Food": ["pizza", "restaurant", "lunch", "dinner", "coffee", "groceries", "breakfast", "snacks"],
+    "Travel": ["uber", "taxi", "flight", "train", "bus", "cab", "fuel", "petrol"],
+    "Bills": ["electricity", "water", "internet", "phone", "gas", "rent"],
+}
+
+# Upper bound on remembered description -> category corrections per user.
+MEMO_MAX_ENTRIES = 500
+
+_NOISE = re.compile(r"[^a-z]+")
+
+
+class CategoryMatcher:
+    # All keywords are compiled into one trie-shaped regex so a description
+    # is scanned once, in C, however many keywords there are. Overlapping
+    # matches are resolved by priority: the earliest category in the list
+    # given to the constructor wins, no matter where in the description it
+    # matched. That is the same answer the old per-category loop gave.
+
+    def __init__(self, keyword_groups):
+        self.categories = []
+        priority = {}
+        for category, keywords in keyword_groups:
+            for keyword in keywords:
+                keyword = keyword.strip().lower()
+                if keyword and keyword not in priority:
+                    priority[keyword] = len(self.categories)
+            self.categories.append(category)
+
+        # At each position the regex reports the longest keyword starting
+        # there; every shorter keyword matching at that position is one of
+        # its prefixes, so fold their priorities in up front.
+        self._priority = {
+            keyword: min(priority.get(keyword[:i], len(self.categories)) for i in range(1, len(keyword) + 1))
+            for keyword in priority
+        }
+        trie = {}
+        for keyword in priority:
+            node = trie
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[""] = True
+        # The zero-width lookahead lets matches overlap, so no keyword is
+        # hidden inside another match.
+        self._pattern = re.compile("(?=(" + _trie_pattern(trie) + "))") if trie else None
+
+    def match(self, description):
+        if self._pattern is None:
+            return "Other"
+        best = None
+        for match in self._pattern.finditer(description.lower()):
+            priority = self._priority[match.group(1)]
+            if best is None or priority < best:
+                best = priority
+                if best == 0:
+                    break
+        return self.categories[best] if best is not None else "Other"
+
+    def match_many(self, descriptions):
+        # Bulk imports repeat the same merchant strings a lot, so each
+        # distinct description is matched only once per call.
+        seen = {}
+        results = []
+        for description in descriptions:
+            category = seen.get(description)
+            if category is None:
+                category = seen[description] = self.match(description)
+            results.append(category)
+        return results
+
+
+def _trie_pattern(node):
+    branches = [re.escape(char) + _trie_pattern(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ""
+    body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    # Greedy optional group: prefer the longer keyword when one ends here.
+    return f"(?:{body})?" if "" in node else body
+
+
+class CategoryMemo:
+    # Categories the user picked by hand, keyed by normalized description
+    # and ordered from least to most recently confirmed. Once full, the
+    # least recently confirmed entry is dropped.
+
+    def __init__(self, entries=None, max_entries=MEMO_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict(entries or {})
+
+    def lookup(self, description):
+        return self.entries.get(normalize_description(description))
+
+    def remember(self, description, category):
+        key = normalize_description(description)
+        if not key:
+            return
+        self.entries.pop(key, None)
+        self.entries[key] = category
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+def normalize_description(description):
+    # "UBER *TRIP 8841" and "Uber Trip 1203" share the key "uber trip".
+    return _NOISE.sub(" ", description.lower()).strip()
+
+
+@lru_cache(maxsize=128)
+def _compiled_matcher(rules):
+    # User rules ({category: [keywords]}) take precedence over the built-in
+    # keywords; rules arrive as a hashable tuple so matchers can be reused.
+    return CategoryMatcher(list(rules) + list(CATEGORY_KEYWORDS.items()))
+
+
+def get_matcher(rules=None):
+    rules = rules or {}
+    return _compiled_matcher(tuple((category, tuple(keywords)) for category, keywords in rules.items()))
+
+
+def suggest_category(description, rules=None, memo=None):
+    if memo is not None:
+        category = memo.lookup(description)
+        if category is not None:
+            return category
+    return get_matcher(rules).match(description)
+
+
+def suggest_categories(descriptions, rules=None, memo=None):
+    if memo is None:
+        return get_matcher(rules).match_many(descriptions)
+    remembered = [memo.lookup(description) for description in descriptions]
+    misses = [d for d, category in zip(descriptions, remembered) if category is None]
+    matched = iter(get_matcher(rules).match_many(misses))
+    return [category if category is not None else next(matched) for category in remembered]
+
+
+def make_rules(rules):
+    # Validates user rules, {category: [keywords]}. Returns them with
+    # keywords stripped and categories left without any dropped, or raises
+    # ValueError.
+    if not isinstance(rules, dict):
+        raise ValueError("rules must map categories to lists of keywords")
+    cleaned = {}
+    for category, keywords in rules.items():
+        if not isinstance(category, str) or not category.strip():
+            raise ValueError("category names must be non-empty strings")
+        if not isinstance(keywords, list) or not all(isinstance(keyword, str) for keyword in keywords):
+            raise ValueError(f"keywords for {category!r} must be a list of strings")
+        keywords = [keyword.strip() for keyword in keywords if keyword.strip()]
+        if keywords:
+            cleaned[category.strip()] = keywords
+    return cleaned
+
+
+def save_rules(username, rules):
+    # Replaces the user's rules; raises ValueError for invalid ones.
+    storage.save_category_rules(username, make_rules(rules))
+
+
+def set_rule(username, category, keywords):
+    # Sets one category's keywords, or removes its rule when there are
+    # none. Returns the user's rules.
+    with user_lock(username):
+        rules = dict(storage.load_category_rules(username), **{category: keywords})
+        rules = make_rules(rules)
+        storage.save_category_rules(username, rules)
+        return rules
+
+
+def load_memo(username):
+    return CategoryMemo(storage.load_category_memo(username))
+
+
+def learn_category(username, description, category):
+    with user_lock(username):
+        memo = load_memo(username)
+        memo.remember(description, category)
+        storage.save_category_memo(username, memo.entries)
@@ -0,0 +1,125 @@
+import hashlib
+import io
+import json
+import os
+import tempfile
+
+# Server-side renderings of the CLI charts. A chart is keyed by a hash of
+# exactly the numbers it plots, so a user whose aggregates have not changed
+# is served the cached file without touching matplotlib, and users with
+# identical data share one file. The cache directory is trimmed to
+# CHART_CACHE_MAX_BYTES, least recently served first.
+CHART_CACHE_DIR = os.environ.get("PFM_CHART_CACHE_DIR", "chart_cache")
+CHART_CACHE_MAX_BYTES = int(os.environ.get("PFM_CHART_CACHE_MAX_BYTES", 50 * 1024 * 1024))
+
+CHART_FORMATS = {"png": "image/png", "svg": "image/svg+xml"}
+
+
+def _expenses_by_category_data(aggregates):
+    categories = aggregates["categories"]
+    return {"categories": list(categories), "amounts": list(categories.values())}
+
+
+def _income_vs_expense_data(aggregates):
+    months = sorted(aggregates["months"])
+    return {
+        "months": months,
+        "income": [aggregates["months"][m]["income"] for m in months],
+        "expense": [aggregates["months"][m]["expense"] for m in months],
+    }
+
+
+def _draw_expenses_by_category(ax, data):
+    ax.bar(data["categories"], data["amounts"])
+    ax.set_xlabel("Category")
+    ax.set_ylabel("Total Expense")
+    ax.set_title("Expenses by Category")
+
+
+def _draw_income_vs_expense(ax, data):
+    ax.plot(data["months"], data["income"], label="Income", marker="o")
+    ax.plot(data["months"], data["expense"], label="Expense", marker="o")
+    ax.set_xlabel("Month")
+    ax.set_ylabel("Amount")
+    ax.set_title("Monthly Income vs. Expense")
+    ax.legend()
+
+
+CHARTS = {
+    "expenses_by_category": (_expenses_by_category_data, _draw_expenses_by_category),
+    "income_vs_expense": (_income_vs_expense_data, _draw_income_vs_expense),
+}
+
+
+def chart_key(name, fmt, aggregates):
+    data = CHARTS[name][0](aggregates)
+    payload = json.dumps({"chart": name, "format": fmt, "data": data}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest(), data
+
+
+def render_chart(name, fmt, aggregates):
+    # Returns (absolute path, key) for the rendered chart, rendering only on
+    # a miss.
+    key, data = chart_key(name, fmt, aggregates)
+    path = os.path.abspath(os.path.join(CHART_CACHE_DIR, f"{key}.{fmt}"))
+    try:
+        os.utime(path)
+        return path, key
+    except FileNotFoundError:
+        pass
+
+    # Two requests missing on the same key at once both render; the file is
+    # replaced atomically, so the loser's write is merely redundant.
+    _write_chart(path, _render(CHARTS[name][1], data, fmt))
+    _evict()
+    return path, key
+
+
+def _render(draw, data, fmt):
+    # Figure without pyplot: no global state, no GUI backend, safe to use
+    # from request threads.
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(8, 5))
+    ax = fig.subplots()
+    if any(data.values()):
+        draw(ax, data)
+    else:
+        ax.text(0.5, 0.5, "No data to display", ha="center", va="center")
+        ax.set_axis_off()
+    fig.tight_layout()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def _write_chart(path, content):
+    # A temp file of its own per call, like locking.atomic_write_json, so
+    # request threads rendering the same chart never share one.
+    os.makedirs(CHART_CACHE_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _evict():
+    files = []
+    for entry in os.scandir(CHART_CACHE_DIR):
+        if entry.is_file() and not entry.name.startswith("."):
+            st = entry.stat()
+            files.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= CHART_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
@@ -0,0 +1,114 @@
+import sys
+from datetime import date
+
+# Compact in-memory form of a ledger entry. The JSON documents repeat every
+# key and the date string in each entry dict; an Entry keeps the amount, the
+# date as a day ordinal (0 when undated), the source or description, and an
+# interned category, in slots. Anything else found in a stored entry is kept
+# in `extra` so to_dict() round-trips to the original JSON.
+#
+# Entries loaded through storage are shared by every reader of the cached
+# ledger and must be treated as read-only.
+_FIELDS = {"income": ("source", "amount", "date"), "expense": ("description", "category", "amount", "date")}
+
+
+class Entry:
+    __slots__ = ("kind", "amount", "day", "label", "category", "extra")
+
+    def __init__(self, kind, amount, day=0, label="", category=None, extra=None):
+        self.kind = kind          # "income" or "expense"
+        self.amount = amount
+        self.day = day            # date.toordinal(), 0 when undated
+        self.label = label        # source for income, description for expense
+        self.category = category  # None for income
+        self.extra = extra        # unknown stored keys, or None
+
+    @classmethod
+    def from_dict(cls, kind, record, labels=None):
+        # labels, when given, is a dict used to share identical label strings
+        # across one load.
+        extra = {key: value for key, value in record.items() if key not in _FIELDS[kind]} or None
+        day = 0
+        raw_date = record.get("date")
+        if raw_date:
+            try:
+                day = date.fromisoformat(raw_date).toordinal()
+            except (TypeError, ValueError):
+                # Not an ISO date; keep it verbatim.
+                extra = dict(extra or {}, date=raw_date)
+        label = record.get("source" if kind == "income" else "description", "")
+        if labels is not None:
+            label = labels.setdefault(label, label)
+        category = None
+        if kind == "expense":
+            category = record.get("category", "Other")
+            category = sys.intern(category) if isinstance(category, str) else category
+        return cls(kind, record["amount"], day, label, category, extra)
+
+    @property
+    def date(self):
+        if self.day:
+            return date.fromordinal(self.day).isoformat()
+        return self.extra.get("date") if self.extra else None
+
+    def to_dict(self):
+        if self.kind == "income":
+            record = {"source": self.label, "amount": self.amount}
+        else:
+            record = {"description": self.label, "category": self.category, "amount": self.amount}
+        if self.day:
+            record["date"] = self.date
+        if self.extra:
+            record.update(self.extra)
+        return record
+
+    # Read access by JSON key, so code written against entry dicts (the
+    # aggregates, importer de-duplication) accepts Entry objects unchanged.
+    def get(self, key, default=None):
+        if key == "amount":
+            return self.amount
+        if key == "date":
+            value = self.date
+        elif key == ("source" if self.kind == "income" else "description"):
+            return self.label
+        elif key == "category" and self.kind == "expense":
+            return self.category
+        else:
+            value = self.extra.get(key) if self.extra else None
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __repr__(self):
+        return f"Entry({self.kind!r}, {self.to_dict()!r})"
+
+
+def from_dicts(kind, records):
+    labels = {}
+    return [Entry.from_dict(kind, record, labels) for record in records]
+
+
+def to_dicts(entries):
+    # Accepts a mix of Entry objects and plain dicts.
+    return [entry.to_dict() if isinstance(entry, Entry) else entry for entry in entries]
+
+
+def estimate_entries_size(entries):
+    # Rough footprint of a list of Entry objects. Labels shared within the
+    # list and interned categories are counted once.
+    size = sys.getsizeof(entries)
+    seen = set()
+    for entry in entries:
+        size += sys.getsizeof(entry) + sys.getsizeof(entry.amount) + sys.getsizeof(entry.day)
+        for value in (entry.label, entry.category):
+            if value is not None and id(value) not in seen:
+                seen.add(id(value))
+                size += sys.getsizeof(value)
+        if entry.extra:
+            size += sys.getsizeof(entry.extra) + sum(
+                sys.getsizeof(key) + sys.getsizeof(value) for key, value in entry.extra.items())
+    return size
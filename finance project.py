@@ -1,109 +1,102 @@
-import json
-import os
+import argparse
+import contextlib
+import csv
 import hashlib
-import matplotlib.pyplot as plt
+import json
+import sys
 from datetime import datetime
 
-# Keywords for auto-categorizing expenses
-CATEGORY_KEYWORDS = {
-    "Food": ["pizza", "restaurant", "lunch", "dinner", "coffee", "groceries", "breakfast", "snacks"],
-    "Travel": ["uber", "taxi", "flight", "train", "bus", "cab", "fuel", "petrol"],
-    "Bills": ["electricity", "water", "internet", "phone", "gas", "rent"],
-}
-
-USERS_FILE = "users.json"
+import storage
+from admin import bulk_delete, bulk_reset_passwords, read_password_resets, read_usernames, user_report
+from batch import apply_ops
+from budgets import (DEFAULT_PERIOD, PERIODS, evaluate_all_budgets, evaluate_budget, evaluate_budgets,
+                     make_budget)
+from aggregates import empty_aggregates
+from categorize import CategoryMemo, learn_category, load_memo, set_rule, suggest_category
+from entries import Entry
+from importer import import_statement
+from locking import users_table_lock
+from passwords import hash_password, needs_rehash, verify_password
+from recurring import FREQUENCIES, add_rule, delete_rule, expand_due, load_rules, rebuild_schedule, run_due
 
 MASTER_USERNAME = "MasterVincent"
 MASTER_PASSWORD_HASH = hashlib.sha256("Master@210404".encode()).hexdigest()
 
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
-
 def load_users():
-    if os.path.exists(USERS_FILE):
-        try:
-            with open(USERS_FILE, "r") as f:
-                return json.load(f)
-        except Exception as e:
-            print(f"Error loading users: {e}")
-            return {}
-    else:
+    try:
+        return storage.load_users()
+    except Exception as e:
+        print(f"Error loading users: {e}")
         return {}
 
 def save_users(users):
     try:
-        with open(USERS_FILE, "w") as f:
-            json.dump(users, f, indent=4)
+        storage.save_users(users)
     except Exception as e:
         print(f"Error saving users: {e}")
 
-def get_data_filenames(username):
-    return (f"{username}_income.json", f"{username}_expense.json", f"{username}_budgets.json")
-
 def load_data(username):
-    income_file, expense_file, _ = get_data_filenames(username)
     try:
-        if os.path.exists(income_file):
-            with open(income_file, "r") as f:
-                income_entries = json.load(f)
-        else:
-            income_entries = []
+        return storage.load_data(username)
     except Exception as e:
-        print(f"Error loading income data: {e}")
-        income_entries = []
+        print(f"Error loading data: {e}")
+        return [], []
 
+def append_entries(username, income_entries=(), expense_entries=()):
     try:
-        if os.path.exists(expense_file):
-            with open(expense_file, "r") as f:
-                expense_entries = json.load(f)
-        else:
-            expense_entries = []
+        storage.append_entries(username, income_entries, expense_entries)
     except Exception as e:
-        print(f"Error loading expense data: {e}")
-        expense_entries = []
+        print(f"Error saving data: {e}")
 
-    return income_entries, expense_entries
+def expand_recurring(username):
+    try:
+        written = expand_due(username)
+    except Exception as e:
+        print(f"Error adding recurring entries: {e}")
+        return
+    if written:
+        print(f"Added {written} recurring entries.\n")
 
-def save_data(username, income_entries, expense_entries):
-    income_file, expense_file, _ = get_data_filenames(username)
+def load_budgets(username):
     try:
-        with open(income_file, "w") as f:
-            json.dump(income_entries, f, indent=4)
+        return storage.load_budgets(username)
     except Exception as e:
-        print(f"Error saving income data: {e}")
+        print(f"Error loading budgets: {e}")
+        return {}
+
+def load_aggregates(username):
     try:
-        with open(expense_file, "w") as f:
-            json.dump(expense_entries, f, indent=4)
+        return storage.load_aggregates(username)
     except Exception as e:
-        print(f"Error saving expense data: {e}")
+        print(f"Error loading summary data: {e}")
+        return empty_aggregates()
 
-def load_budgets(username):
-    _, _, budget_file = get_data_filenames(username)
+def load_category_rules(username):
     try:
-        if os.path.exists(budget_file):
-            with open(budget_file, "r") as f:
-                return json.load(f)
-        else:
-            return {}
+        return storage.load_category_rules(username)
     except Exception as e:
-        print(f"Error loading budgets: {e}")
+        print(f"Error loading category rules: {e}")
         return {}
 
+def load_category_memo(username):
+    try:
+        return load_memo(username)
+    except Exception as e:
+        print(f"Error loading learned categories: {e}")
+        return CategoryMemo()
+
+def remember_category(username, description, category):
+    try:
+        learn_category(username, description, category)
+    except Exception as e:
+        print(f"Error saving learned category: {e}")
+
 def save_budgets(username, budgets):
-    _, _, budget_file = get_data_filenames(username)
     try:
-        with open(budget_file, "w") as f:
-            json.dump(budgets, f, indent=4)
+        storage.save_budgets(username, budgets)
     except Exception as e:
         print(f"Error saving budgets: {e}")
 
-def suggest_category(description):
-    description = description.lower()
-    for category, keywords in CATEGORY_KEYWORDS.items():
-        if any(keyword in description for keyword in keywords):
-            return category
-    return "Other"
-
 def get_menu_choice(options):
     while True:
         choice = input("Choose an option: ").strip()
@@ -130,6 +123,7 @@ def show_help():
     print("- Add income and expense entries with descriptions and categories.")
     print("- Automatically categorizes expenses based on keywords.")
     print("- Set budget limits and get alerts when nearing or exceeding budgets.")
+    print("- Recurring income and expenses, added automatically when they fall due.")
     print("- View summaries and visual charts.")
     print("- User authentication with master admin access.")
     print("\nNavigate menus by inputting the numbers shown.")
@@ -154,22 +148,42 @@ def register_user(users):
     print(f"User '{username}' registered successfully.\n")
     return username
 
+def rehash_password(users, username, password):
+    # Reloads the table under its lock and updates only this user, so
+    # accounts registered or changed elsewhere (such as through the web app)
+    # since the CLI started are kept.
+    old_hash = users[username]
+    new_hash = hash_password(password)
+    try:
+        with users_table_lock():
+            current = storage.load_users()
+            # Skip if the password was changed while we were hashing.
+            if current.get(username) == old_hash:
+                current[username] = new_hash
+                storage.save_users(current)
+    except Exception as e:
+        print(f"Error saving users: {e}")
+        return
+    users.update(current)
+
 def login_user(users):
     print("\n--- User Login ---")
     username = input("Username: ").strip()
     password = input("Password: ")
 
     # Master login check
-    if username == MASTER_USERNAME and hash_password(password) == MASTER_PASSWORD_HASH:
+    if username == MASTER_USERNAME and verify_password(password, MASTER_PASSWORD_HASH):
         print("Master login successful. Admin privileges granted.\n")
         return MASTER_USERNAME
 
     if username not in users:
         print("User not found. Please register first.\n")
         return None
-    if users[username] != hash_password(password):
+    if not verify_password(password, users[username]):
         print("Incorrect password.\n")
         return None
+    if needs_rehash(users[username]):
+        rehash_password(users, username, password)
     print(f"Logged in as '{username}'.\n")
     return username
 
@@ -179,12 +193,13 @@ def add_income(username, income_entries, expense_entries):
         print("Source cannot be empty.")
         source = input("Enter income source: ").strip()
     amount = get_positive_float("Enter income amount: ")
-    income_entries.append({
+    entry = {
         "source": source,
         "amount": amount,
         "date": datetime.now().strftime("%Y-%m-%d")
-    })
-    save_data(username, income_entries, expense_entries)
+    }
+    income_entries.append(Entry.from_dict("income", entry))
+    append_entries(username, income_entries=[entry])
     print("Income added and saved successfully.\n")
 
 def set_budget(username, budgets):
@@ -193,49 +208,56 @@ def set_budget(username, budgets):
         print("Category cannot be empty.")
         category = input("Enter category to set budget for: ").strip()
     amount = get_positive_float(f"Enter budget amount for '{category}': ")
-    budgets[category] = amount
+    period = input(f"Budget period ({'/'.join(PERIODS)}, press Enter for {DEFAULT_PERIOD}): ").strip().lower()
+    while period and period not in PERIODS:
+        print(f"Please enter one of {', '.join(PERIODS)}.")
+        period = input(f"Budget period ({'/'.join(PERIODS)}): ").strip().lower()
+    period = period or DEFAULT_PERIOD
+    budgets[category] = make_budget(amount, period)
     save_budgets(username, budgets)
-    print(f"Budget for '{category}' set to {amount:.2f}\n")
-
-def get_category_total(expense_entries, category):
-    return sum(entry["amount"] for entry in expense_entries if entry["category"] == category)
+    print(f"{period.capitalize()} budget for '{category}' set to {amount:.2f}\n")
 
-def check_budget_alert(expense_entries, budgets, category):
+def check_budget_alert(aggregates, budgets, category):
     if category in budgets:
-        spent = get_category_total(expense_entries, category)
-        budget = budgets[category]
-        if spent >= budget:
-            print(f"*** ALERT: You have exceeded your budget for '{category}'! ***")
-        elif spent >= 0.9 * budget:
-            print(f"*** Warning: You are nearing your budget limit for '{category}'. ***")
+        result = evaluate_budget(aggregates, category, budgets[category])
+        scope = PERIOD_LABELS[result["period"]]
+        if result["status"] == "exceeded":
+            print(f"*** ALERT: You have exceeded your {scope}budget for '{category}'! ***")
+        elif result["status"] == "nearing":
+            print(f"*** Warning: You are nearing your {scope}budget limit for '{category}'. ***")
 
 def add_expense(username, income_entries, expense_entries, budgets):
     description = input("Enter expense description: ").strip()
     while description == "":
         print("Description cannot be empty.")
         description = input("Enter expense description: ").strip()
-    auto_category = suggest_category(description)
+    auto_category = suggest_category(description, load_category_rules(username), load_category_memo(username))
     print(f"Suggested category: {auto_category}")
     category = input(f"Enter expense category (Press Enter to accept '{auto_category}'): ").strip()
+    if category and category != auto_category:
+        remember_category(username, description, category)
     category = category if category else auto_category
     amount = get_positive_float("Enter expense amount: ")
-    expense_entries.append({
+    entry = {
         "category": category,
         "amount": amount,
         "description": description,
         "date": datetime.now().strftime("%Y-%m-%d")
-    })
-    save_data(username, income_entries, expense_entries)
+    }
+    expense_entries.append(Entry.from_dict("expense", entry))
+    append_entries(username, expense_entries=[entry])
     print("Expense added and saved successfully.\n")
-    check_budget_alert(expense_entries, budgets, category)
+    check_budget_alert(load_aggregates(username), budgets, category)
 
 def plot_expenses_by_category(expense_entries):
     if not expense_entries:
         print("No expense data to display.\n")
         return
-    category_totals = {}
-    for entry in expense_entries:
-        category_totals[entry["category"]] = category_totals.get(entry["category"], 0) + entry["amount"]
+    # Deferred so that starting the CLI does not pay for NumPy/matplotlib.
+    import matplotlib.pyplot as plt
+    from analytics import ColumnarLedger
+
+    category_totals = ColumnarLedger.from_entries([], expense_entries).category_totals()
     categories = list(category_totals.keys())
     amounts = [category_totals[cat] for cat in categories]
 
@@ -245,9 +267,9 @@ def plot_expenses_by_category(expense_entries):
     plt.title("Expenses by Category")
     plt.show()
 
-def view_summary(income_entries, expense_entries, budgets):
-    total_income = sum(entry["amount"] for entry in income_entries)
-    total_expense = sum(entry["amount"] for entry in expense_entries)
+def view_summary(aggregates, budgets):
+    total_income = aggregates["total_income"]
+    total_expense = aggregates["total_expense"]
 
     print("\n----- Summary -----")
     print(f"Total Income: {total_income:.2f}")
@@ -255,72 +277,221 @@ def view_summary(income_entries, expense_entries, budgets):
     print(f"Balance: {total_income - total_expense:.2f}\n")
 
     print("Expenses by Category:")
-    category_totals = {}
-    for entry in expense_entries:
-        category_totals[entry["category"]] = category_totals.get(entry["category"], 0) + entry["amount"]
-    for category, amount in category_totals.items():
+    for category, amount in aggregates["categories"].items():
         line = f"  {category}: {amount:.2f}"
         if budgets.get(category):
-            line += f" / Budget: {budgets[category]:.2f}"
-            if amount >= budgets[category]:
+            result = evaluate_budget(aggregates, category, budgets[category])
+            line += f" / Budget: {result['amount']:.2f}"
+            if result["period"] != "total":
+                line += f" {result['period']} ({result['spent']:.2f} spent this period)"
+            if result["status"] == "exceeded":
                 line += " (Exceeded)"
-            elif amount >= 0.9 * budgets[category]:
+            elif result["status"] == "nearing":
                 line += " (Nearing limit)"
         print(line)
     print("-------------------\n")
 
+def load_forecast(username, months=None, method=None):
+    # None, after saying why, when there is no forecast to show.
+    try:
+        # Deferred like the charts: NumPy is only needed here.
+        from forecast import DEFAULT_HORIZON, DEFAULT_METHOD, forecast
+    except ImportError:
+        print("Install NumPy to see forecasts.\n")
+        return None
+    try:
+        return forecast(username, months or DEFAULT_HORIZON, method or DEFAULT_METHOD)
+    except Exception as e:
+        print(f"Error building forecast: {e}\n")
+        return None
+
+def print_forecast(result):
+    if result is None:
+        return
+    if not result["history_months"]:
+        print("Not enough history for a forecast yet; check back after your first full month.\n")
+        return
+    method = result["method"].replace("_", " ")
+    print(f"----- Forecast ({method}, from {result['history_months']} months) -----")
+    print(f"{'Month':<9}{'Income':>12}{'Expense':>12}{'Balance':>12}")
+    for month in result["months"]:
+        print(f"{month['month']:<9}{month['income']:>12.2f}{month['expense']:>12.2f}{month['balance']:>12.2f}")
+    print("Expected spending by category:")
+    for category, amounts in result["categories"].items():
+        if any(amounts):
+            print(f"  {category}: {', '.join(f'{amount:.2f}' for amount in amounts)}")
+    print("-------------------\n")
+
 def plot_income_vs_expense_over_time(income_entries, expense_entries):
     if not income_entries and not expense_entries:
         print("No income or expense data to display.\n")
         return
-    def get_month_key(date_str):
-        dt = datetime.strptime(date_str, "%Y-%m-%d")
-        return dt.strftime("%Y-%m")
 
-    filtered_entries = [e for e in income_entries + expense_entries if 'date' in e]
+    import matplotlib.pyplot as plt
+    from analytics import ColumnarLedger
 
-    if not filtered_entries:
+    months, income_monthly, expense_monthly = ColumnarLedger.from_entries(
+        income_entries, expense_entries).monthly_totals()
+
+    if not months:
         print("No dated entries to plot.\n")
         return
 
-    months = sorted({get_month_key(e["date"]) for e in filtered_entries})
-
-    income_monthly = {m: 0 for m in months}
-    expense_monthly = {m: 0 for m in months}
-
-    for e in income_entries:
-        if 'date' in e:
-            m = get_month_key(e["date"])
-            income_monthly[m] += e["amount"]
-
-    for e in expense_entries:
-        if 'date' in e:
-            m = get_month_key(e["date"])
-            expense_monthly[m] += e["amount"]
-
-    plt.plot(months, [income_monthly[m] for m in months], label="Income", marker="o")
-    plt.plot(months, [expense_monthly[m] for m in months], label="Expense", marker="o")
+    plt.plot(months, income_monthly, label="Income", marker="o")
+    plt.plot(months, expense_monthly, label="Expense", marker="o")
     plt.xlabel("Month")
     plt.ylabel("Amount")
     plt.title("Monthly Income vs. Expense")
     plt.legend()
     plt.show()
 
+def open_input(path):
+    # "-" reads from stdin, for piping lists in from other tools.
+    if path == "-":
+        return contextlib.nullcontext(sys.stdin)
+    return open(path, "r", encoding="utf-8", newline="")
+
+def run_bulk_delete(path):
+    try:
+        with open_input(path) as f:
+            usernames = read_usernames(f)
+    except OSError as e:
+        print(f"Error reading {path}: {e}")
+        return 1
+    try:
+        deleted, skipped = bulk_delete(usernames, protected=(MASTER_USERNAME,))
+    except Exception as e:
+        print(f"Error deleting users: {e}")
+        return 1
+    print(f"Deleted {len(deleted)} user(s) and their data.")
+    if skipped:
+        print(f"Skipped {len(skipped)} unknown or protected user(s): {', '.join(skipped)}")
+    return 0
+
+def run_bulk_reset(path):
+    try:
+        with open_input(path) as f:
+            resets = read_password_resets(f)
+    except (OSError, ValueError) as e:
+        print(f"Error reading {path}: {e}")
+        return 1
+    try:
+        reset, skipped = bulk_reset_passwords(resets, protected=(MASTER_USERNAME,))
+    except Exception as e:
+        print(f"Error resetting passwords: {e}")
+        return 1
+    print(f"Reset {len(reset)} password(s).")
+    if skipped:
+        print(f"Skipped {len(skipped)} unknown or protected user(s): {', '.join(skipped)}")
+    return 0
+
+def print_user_report(rows):
+    for row in rows:
+        line = (f"{row['username']}: income {row['total_income']:.2f}, expense {row['total_expense']:.2f}, "
+                f"balance {row['balance']:.2f}")
+        breaches = ", ".join(f"{b['category']} {b['spent']:.2f} of {b['amount']:.2f} {b['period']}"
+                             for b in row["breaches"])
+        print(line + (f"; over budget: {breaches}" if breaches else ""))
+    print(f"{len(rows)} user(s), {sum(1 for row in rows if row['breaches'])} over budget.")
+
+# Unit of a rule's interval, for describe_rule.
+FREQUENCY_UNITS = {"daily": "day", "weekly": "week", "monthly": "month", "custom": "day"}
+
+def describe_rule(rule_id, rule):
+    entry = rule["entry"]
+    label = entry.get("source") or entry.get("description")
+    unit = FREQUENCY_UNITS[rule["frequency"]]
+    every = unit if rule["interval"] == 1 else f"{rule['interval']} {unit}s"
+    category = f" ({entry['category']})" if entry.get("category") else ""
+    until = f" until {rule['end']}" if rule.get("end") else ""
+    return (f"[{rule_id}] {rule['type'].capitalize()}: {label}{category} {entry['amount']:.2f} "
+            f"every {every} from {rule['start']}{until}, next {rule['next_due'] or 'none'}")
+
+def list_recurring(username):
+    try:
+        rules = load_rules(username)
+    except Exception as e:
+        print(f"Error loading recurring rules: {e}")
+        return
+    if not rules:
+        print("No recurring rules.")
+    for rule_id, rule in rules.items():
+        print(describe_rule(rule_id, rule))
+
+def add_recurring(username):
+    entry_type = input("Income or expense? ").strip().lower()
+    while entry_type not in ("income", "expense"):
+        print("Please enter income or expense.")
+        entry_type = input("Income or expense? ").strip().lower()
+    label_field = "source" if entry_type == "income" else "description"
+    op = {"type": entry_type, label_field: input(f"Enter {label_field}: ").strip()}
+    if entry_type == "expense":
+        op["category"] = input("Enter category (press Enter for a suggestion): ").strip() or None
+    op["amount"] = get_positive_float("Enter amount: ")
+    frequency = input(f"Frequency ({'/'.join(FREQUENCIES)}): ").strip().lower()
+    while frequency not in FREQUENCIES:
+        print(f"Please enter one of {', '.join(FREQUENCIES)}.")
+        frequency = input(f"Frequency ({'/'.join(FREQUENCIES)}): ").strip().lower()
+    op["frequency"] = frequency
+    unit = FREQUENCY_UNITS[frequency]
+    interval = input(f"Repeat every how many {unit}s? " + ("" if frequency == "custom" else "(press Enter for 1) ")).strip()
+    op["interval"] = int(interval) if interval.isdigit() else (interval or None)
+    op["start"] = input("Start date YYYY-MM-DD (press Enter for today): ").strip() or None
+    op["end"] = input("End date YYYY-MM-DD (press Enter for none): ").strip() or None
+    try:
+        rule_id, rule, written = add_rule(username, op)
+    except ValueError as e:
+        print(f"Rule not saved: {e}\n")
+        return
+    except Exception as e:
+        print(f"Error saving recurring rule: {e}\n")
+        return
+    print(f"Saved {describe_rule(rule_id, rule)}")
+    print(f"Added {written} entries due so far.\n")
+
+def remove_recurring(username):
+    rule_id = input("Enter the id of the rule to delete: ").strip()
+    try:
+        deleted = delete_rule(username, rule_id)
+    except Exception as e:
+        print(f"Error deleting recurring rule: {e}\n")
+        return
+    print("Rule deleted; entries it already added are kept.\n" if deleted else "Rule not found.\n")
+
+def recurring_menu(username):
+    while True:
+        print("\n--- Recurring Income and Expenses ---")
+        print("1. List rules")
+        print("2. Add rule")
+        print("3. Delete rule")
+        print("4. Back")
+        choice = get_menu_choice({"1", "2", "3", "4"})
+
+        if choice == "1":
+            list_recurring(username)
+        elif choice == "2":
+            add_recurring(username)
+        elif choice == "3":
+            remove_recurring(username)
+        elif choice == "4":
+            break
+
 def admin_menu(users):
     while True:
         print("\n--- Master Admin Menu ---")
         print("1. List all users")
         print("2. Reset user password")
         print("3. Delete user account")
-        print("4. Logout")
-        choice = get_menu_choice({"1", "2", "3", "4"})
+        print("4. Bulk delete users from a file")
+        print("5. Bulk reset passwords from a CSV file")
+        print("6. Report totals and budget breaches for all users")
+        print("7. Logout")
+        choice = get_menu_choice({"1", "2", "3", "4", "5", "6", "7"})
 
         if choice == "1":
-            print("\nRegistered Users:")
-            for user in users:
-                if user != MASTER_USERNAME:
-                    print(f"- {user}")
-            print()
+            usernames = sorted(user for user in users if user != MASTER_USERNAME)
+            print(f"\nRegistered Users ({len(usernames)}):")
+            print("".join(f"- {user}\n" for user in usernames))
         elif choice == "2":
             username = input("Enter the username to reset password: ").strip()
             if username == MASTER_USERNAME:
@@ -345,19 +516,32 @@ def admin_menu(users):
                 if confirm == "yes":
                     users.pop(username)
                     save_users(users)
-                    income_file, expense_file, budget_file = get_data_filenames(username)
-                    for file in [income_file, expense_file, budget_file]:
-                        if os.path.exists(file):
-                            try:
-                                os.remove(file)
-                            except Exception as e:
-                                print(f"Error deleting file {file}: {e}")
+                    try:
+                        storage.delete_user_data(username)
+                    except Exception as e:
+                        print(f"Error deleting data for {username}: {e}")
                     print(f"User '{username}' and their data deleted.\n")
                 else:
                     print("Deletion cancelled.\n")
             else:
                 print("User not found.\n")
         elif choice == "4":
+            run_bulk_delete(input("File with one username per line: ").strip())
+            users.clear()
+            users.update(load_users())
+            print()
+        elif choice == "5":
+            run_bulk_reset(input("CSV file of username,new_password rows: ").strip())
+            users.clear()
+            users.update(load_users())
+            print()
+        elif choice == "6":
+            try:
+                print_user_report(user_report([user for user in users if user != MASTER_USERNAME]))
+            except Exception as e:
+                print(f"Error building report: {e}")
+            print()
+        elif choice == "7":
             print("Logging out of master admin account.\n")
             break
 
@@ -383,6 +567,7 @@ def main():
                             admin_menu(users)
                             current_user = None
                         else:
+                            expand_recurring(current_user)
                             income_entries, expense_entries = load_data(current_user)
                             budgets = load_budgets(current_user)
                 elif choice == "2":
@@ -406,14 +591,16 @@ def main():
                 print("6. Visualize Expenses by Category")
                 print("7. Visualize Monthly Income vs. Expense")
                 print("8. Help")
-                choice = get_menu_choice({"1", "2", "3", "4", "5", "6", "7", "8"})
+                print("9. Recurring Income and Expenses")
+                choice = get_menu_choice({"1", "2", "3", "4", "5", "6", "7", "8", "9"})
 
                 if choice == "1":
                     add_income(current_user, income_entries, expense_entries)
                 elif choice == "2":
                     add_expense(current_user, income_entries, expense_entries, budgets)
                 elif choice == "3":
-                    view_summary(income_entries, expense_entries, budgets)
+                    view_summary(load_aggregates(current_user), budgets)
+                    print_forecast(load_forecast(current_user))
                 elif choice == "4":
                     set_budget(current_user, budgets)
                 elif choice == "5":
@@ -425,9 +612,365 @@ def main():
                     plot_income_vs_expense_over_time(income_entries, expense_entries)
                 elif choice == "8":
                     show_help()
+                elif choice == "9":
+                    recurring_menu(current_user)
+                    income_entries, expense_entries = load_data(current_user)
 
     except KeyboardInterrupt:
         print("\n\nProgram interrupted. Exiting gracefully. Goodbye!")
 
+# Fields, in order, of headerless CSV lines read from stdin by each command.
+STDIN_FIELDS = {
+    "income": ("source", "amount", "date"),
+    "expense": ("description", "amount", "category", "date"),
+    "budget": ("category", "amount", "period"),
+}
+
+# Inserted before "budget" in alert messages.
+PERIOD_LABELS = {"monthly": "monthly ", "weekly": "weekly ", "total": ""}
+
+def user_exists(username):
+    if username not in load_users():
+        print(f"User '{username}' not found.")
+        return False
+    return True
+
+def read_stdin_ops(op_type):
+    # Each line is either a JSON object or CSV fields in STDIN_FIELDS order.
+    for row_number, line in enumerate(sys.stdin, start=1):
+        if not line.strip():
+            continue
+        if line.lstrip().startswith("{"):
+            try:
+                op = json.loads(line)
+            except ValueError:
+                op = None
+        else:
+            values = next(csv.reader([line]))
+            op = {field: value for field, value in zip(STDIN_FIELDS[op_type], values) if value.strip()}
+        if isinstance(op, dict):
+            op = dict(op, type=op_type)
+        yield op
+
+def commit_ops(username, ops):
+    ops = list(ops)
+    if not ops:
+        print("No entries given.")
+        return 1
+    applied, results = apply_ops(username, ops, max_ops=None)
+    if not applied:
+        for result in results:
+            if result["status"] == "error":
+                print(f"Entry {result['index'] + 1}: {result['error']}")
+        print("No entries were saved.")
+        return 1
+    print(f"Saved {len(results)} entries.")
+    return 0
+
+def add_income_command(args):
+    if not user_exists(args.username):
+        return 1
+    ops = [{"type": "income", "source": source, "amount": amount, "date": args.date}
+           for source, amount in args.entry or []]
+    if args.stdin:
+        ops.extend(read_stdin_ops("income"))
+    return commit_ops(args.username, ops)
+
+def add_expense_command(args):
+    if not user_exists(args.username):
+        return 1
+    ops = [{"type": "expense", "description": description, "amount": amount,
+            "category": args.category, "date": args.date}
+           for description, amount in args.entry or []]
+    if args.stdin:
+        ops.extend(read_stdin_ops("expense"))
+    return commit_ops(args.username, ops)
+
+def set_budget_command(args):
+    if not user_exists(args.username):
+        return 1
+    ops = [{"type": "budget", "category": category, "amount": amount, "period": args.period}
+           for category, amount in args.budget or []]
+    if args.stdin:
+        ops.extend(read_stdin_ops("budget"))
+    return commit_ops(args.username, ops)
+
+def summary_command(args):
+    if not user_exists(args.username):
+        return 1
+    # With --json, stdout carries only the JSON document; status and error
+    # messages from loading go to stderr.
+    with contextlib.redirect_stdout(sys.stderr) if args.json else contextlib.nullcontext():
+        expand_recurring(args.username)
+        aggregates = load_aggregates(args.username)
+        budgets = load_budgets(args.username)
+        forecast = load_forecast(args.username, args.forecast, args.method) if args.forecast != 0 else None
+    if args.json:
+        print(json.dumps({
+            "total_income": aggregates["total_income"],
+            "total_expense": aggregates["total_expense"],
+            "balance": aggregates["total_income"] - aggregates["total_expense"],
+            "categories": aggregates["categories"],
+            "months": aggregates["months"],
+            "budgets": evaluate_budgets(aggregates, budgets),
+            "forecast": forecast,
+        }, indent=2))
+    else:
+        view_summary(aggregates, budgets)
+        print_forecast(forecast)
+    return 0
+
+def budget_alerts_command(args):
+    # Nightly job: every user's budgets in one pass over the aggregates.
+    alerts = [dict(result, username=username)
+              for username, results in evaluate_all_budgets()
+              for result in results if result["status"] != "ok"]
+    if args.json:
+        print(json.dumps(alerts, indent=2))
+    else:
+        for alert in alerts:
+            print(f"{alert['username']}: {alert['category']} {alert['status']} "
+                  f"({alert['spent']:.2f} of {alert['amount']:.2f}, {alert['period']})")
+        print(f"{len(alerts)} budget alert(s).")
+    return 0
+
+def import_command(args):
+    if not user_exists(args.username):
+        return 1
+    try:
+        with open(args.statement, "r", encoding="utf-8-sig", newline="") as f:
+            result = import_statement(args.username, f, args.statement, args.day_first)
+    except (OSError, ValueError) as e:
+        print(f"Error importing statement: {e}")
+        return 1
+    print(f"Imported {result['income']} income and {result['expense']} expense entries "
+          f"({result['duplicates']} duplicates skipped, {result['invalid']} invalid rows).")
+    return 0
+
+def add_recurring_command(args):
+    if not user_exists(args.username):
+        return 1
+    label_field = "source" if args.type == "income" else "description"
+    op = {"type": args.type, label_field: args.label, "amount": args.amount, "category": args.category,
+          "frequency": args.frequency, "interval": args.interval, "start": args.start, "end": args.end}
+    try:
+        rule_id, rule, written = add_rule(args.username, op)
+    except ValueError as e:
+        print(f"Rule not saved: {e}")
+        return 1
+    print(f"Saved {describe_rule(rule_id, rule)}")
+    print(f"Added {written} entries due so far.")
+    return 0
+
+def list_recurring_command(args):
+    if not user_exists(args.username):
+        return 1
+    if args.json:
+        print(json.dumps(load_rules(args.username), indent=2))
+    else:
+        list_recurring(args.username)
+    return 0
+
+def delete_recurring_command(args):
+    if not user_exists(args.username):
+        return 1
+    if not delete_rule(args.username, args.rule_id):
+        print(f"Rule '{args.rule_id}' not found.")
+        return 1
+    print(f"Rule '{args.rule_id}' deleted; entries it already added are kept.")
+    return 0
+
+def set_category_rule_command(args):
+    if not user_exists(args.username):
+        return 1
+    try:
+        rules = set_rule(args.username, args.category, args.keyword)
+    except ValueError as e:
+        print(f"Rule not saved: {e}")
+        return 1
+    if args.category in rules:
+        print(f"Descriptions containing {', '.join(rules[args.category])} now suggest '{args.category}'.")
+    else:
+        print(f"Rule for '{args.category}' removed.")
+    return 0
+
+def list_category_rules_command(args):
+    if not user_exists(args.username):
+        return 1
+    rules = load_category_rules(args.username)
+    if args.json:
+        print(json.dumps(rules, indent=2))
+    else:
+        if not rules:
+            print("No category rules.")
+        for category, keywords in rules.items():
+            print(f"{category}: {', '.join(keywords)}")
+    return 0
+
+def run_recurring_command(args):
+    # Nightly job: writes the entries of every rule due up to today (or
+    # --date), touching only users with a rule due.
+    if args.rebuild:
+        print(f"Schedule rebuilt: {rebuild_schedule()} user(s) with pending rules.")
+    users, written = run_due(args.date)
+    print(f"Added {written} recurring entries for {users} user(s).")
+    return 0
+
+def migrate_data_command(args):
+    # Safe to run while the web app is serving: each user is switched over
+    # atomically under their lock.
+    try:
+        migrated = storage.migrate_layout(args.username or None, args.grace)
+    except OSError as e:
+        print(f"Error migrating data: {e}")
+        return 1
+    print(f"Moved {migrated} user(s) into {storage.DATA_DIR}.")
+    return 0
+
+def admin_delete_command(args):
+    return run_bulk_delete(args.file)
+
+def admin_reset_command(args):
+    return run_bulk_reset(args.file)
+
+def admin_report_command(args):
+    try:
+        rows = user_report([user for user in storage.load_users() if user != MASTER_USERNAME], args.workers)
+    except Exception as e:
+        print(f"Error building report: {e}")
+        return 1
+    if args.json:
+        print(json.dumps(rows, indent=2))
+    else:
+        print_user_report(rows)
+    return 0
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Personal Finance Manager. Run without arguments for the interactive menu.")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    stdin_help = "Also read entries from stdin, one per line, as JSON objects or CSV fields: {}."
+
+    income_parser = subcommands.add_parser("add-income", help="Add income entries for a user in one write.")
+    income_parser.add_argument("username")
+    income_parser.add_argument("--entry", nargs=2, action="append", metavar=("SOURCE", "AMOUNT"))
+    income_parser.add_argument("--date", help="YYYY-MM-DD for --entry values (default: today).")
+    income_parser.add_argument("--stdin", action="store_true", help=stdin_help.format(", ".join(STDIN_FIELDS["income"])))
+    income_parser.set_defaults(handler=add_income_command)
+
+    expense_parser = subcommands.add_parser("add-expense", help="Add expense entries for a user in one write.")
+    expense_parser.add_argument("username")
+    expense_parser.add_argument("--entry", nargs=2, action="append", metavar=("DESCRIPTION", "AMOUNT"))
+    expense_parser.add_argument("--category", help="Category for --entry values (default: suggested).")
+    expense_parser.add_argument("--date", help="YYYY-MM-DD for --entry values (default: today).")
+    expense_parser.add_argument("--stdin", action="store_true",
+                                help=stdin_help.format(", ".join(STDIN_FIELDS["expense"])))
+    expense_parser.set_defaults(handler=add_expense_command)
+
+    budget_parser = subcommands.add_parser("set-budget", help="Set category budgets for a user in one write.")
+    budget_parser.add_argument("username")
+    budget_parser.add_argument("--budget", nargs=2, action="append", metavar=("CATEGORY", "AMOUNT"))
+    budget_parser.add_argument("--period", choices=PERIODS, default=DEFAULT_PERIOD,
+                               help="Period for --budget values (default: %(default)s).")
+    budget_parser.add_argument("--stdin", action="store_true", help=stdin_help.format(", ".join(STDIN_FIELDS["budget"])))
+    budget_parser.set_defaults(handler=set_budget_command)
+
+    summary_parser = subcommands.add_parser("summary", help="Print a user's totals and budgets.")
+    summary_parser.add_argument("username")
+    summary_parser.add_argument("--json", action="store_true", help="Print machine-readable JSON.")
+    summary_parser.add_argument("--forecast", type=int, metavar="MONTHS",
+                                help="Months to project, counting the current one (default: 3; 0 for none).")
+    summary_parser.add_argument("--method", choices=("moving_average", "exponential", "linear"),
+                                help="Forecast method (default: exponential).")
+    summary_parser.set_defaults(handler=summary_command)
+
+    alerts_parser = subcommands.add_parser("budget-alerts", help="List budgets nearing or over their limit for all users.")
+    alerts_parser.add_argument("--json", action="store_true", help="Print machine-readable JSON.")
+    alerts_parser.set_defaults(handler=budget_alerts_command)
+
+    import_parser = subcommands.add_parser("import", help="Import a CSV or OFX bank statement for a user.")
+    import_parser.add_argument("username")
+    import_parser.add_argument("statement", help="Path to the statement file.")
+    date_order = import_parser.add_mutually_exclusive_group()
+    date_order.add_argument("--day-first", dest="day_first", action="store_const", const=True,
+                            help="Dates are DD/MM/YYYY (needed only when no date in the file shows it).")
+    date_order.add_argument("--month-first", dest="day_first", action="store_const", const=False,
+                            help="Dates are MM/DD/YYYY.")
+    import_parser.set_defaults(handler=import_command)
+
+    add_recurring_parser = subcommands.add_parser(
+        "add-recurring", help="Add a recurring income or expense, writing the entries already due.")
+    add_recurring_parser.add_argument("username")
+    add_recurring_parser.add_argument("type", choices=("income", "expense"))
+    add_recurring_parser.add_argument("label", help="Income source or expense description.")
+    add_recurring_parser.add_argument("amount")
+    add_recurring_parser.add_argument("--frequency", choices=FREQUENCIES, required=True)
+    add_recurring_parser.add_argument("--interval", type=int,
+                                      help="Repeat every N days/weeks/months (default: 1; required for custom, in days).")
+    add_recurring_parser.add_argument("--category", help="Expense category (default: suggested).")
+    add_recurring_parser.add_argument("--start", help="YYYY-MM-DD of the first occurrence (default: today).")
+    add_recurring_parser.add_argument("--end", help="YYYY-MM-DD after which the rule stops.")
+    add_recurring_parser.set_defaults(handler=add_recurring_command)
+
+    list_recurring_parser = subcommands.add_parser("list-recurring", help="List a user's recurring rules.")
+    list_recurring_parser.add_argument("username")
+    list_recurring_parser.add_argument("--json", action="store_true", help="Print machine-readable JSON.")
+    list_recurring_parser.set_defaults(handler=list_recurring_command)
+
+    delete_recurring_parser = subcommands.add_parser("delete-recurring", help="Stop a recurring rule.")
+    delete_recurring_parser.add_argument("username")
+    delete_recurring_parser.add_argument("rule_id")
+    delete_recurring_parser.set_defaults(handler=delete_recurring_command)
+
+    set_rule_parser = subcommands.add_parser(
+        "set-category-rule", help="Suggest a category for expenses whose description has any of the keywords.")
+    set_rule_parser.add_argument("username")
+    set_rule_parser.add_argument("category")
+    set_rule_parser.add_argument("keyword", nargs="*", help="Keywords to match (none removes the rule).")
+    set_rule_parser.set_defaults(handler=set_category_rule_command)
+
+    list_rules_parser = subcommands.add_parser("list-category-rules", help="List a user's category rules.")
+    list_rules_parser.add_argument("username")
+    list_rules_parser.add_argument("--json", action="store_true", help="Print machine-readable JSON.")
+    list_rules_parser.set_defaults(handler=list_category_rules_command)
+
+    run_recurring_parser = subcommands.add_parser(
+        "run-recurring", help="Write every user's recurring entries that have fallen due.")
+    run_recurring_parser.add_argument("--date", type=lambda value: datetime.strptime(value, "%Y-%m-%d").date(),
+                                      help="YYYY-MM-DD to run up to (default: today).")
+    run_recurring_parser.add_argument("--rebuild", action="store_true",
+                                      help="First recompute the schedule from every user's rules.")
+    run_recurring_parser.set_defaults(handler=run_recurring_command)
+
+    migrate_parser = subcommands.add_parser(
+        "migrate-data", help="Move user files from the old flat layout into the sharded data directory.")
+    migrate_parser.add_argument("username", nargs="*", help="Users to move (default: all).")
+    migrate_parser.add_argument("--grace", type=float, default=storage.MIGRATION_GRACE_SECONDS,
+                                help="Seconds to wait before deleting the old files (default: %(default)s).")
+    migrate_parser.set_defaults(handler=migrate_data_command)
+
+    admin_delete_parser = subcommands.add_parser(
+        "admin-delete", help="Delete the accounts and data of the users listed in a file, one per line.")
+    admin_delete_parser.add_argument("file", help="Path to the list, or - for stdin.")
+    admin_delete_parser.set_defaults(handler=admin_delete_command)
+
+    admin_reset_parser = subcommands.add_parser(
+        "admin-reset", help="Reset passwords from a CSV file of username,new_password rows.")
+    admin_reset_parser.add_argument("file", help="Path to the CSV file, or - for stdin.")
+    admin_reset_parser.set_defaults(handler=admin_reset_command)
+
+    admin_report_parser = subcommands.add_parser(
+        "admin-report", help="Totals and exceeded budgets for every user, scanned in parallel.")
+    admin_report_parser.add_argument("--workers", type=int, help="Worker processes (default: one per CPU).")
+    admin_report_parser.add_argument("--json", action="store_true", help="Print machine-readable JSON.")
+    admin_report_parser.set_defaults(handler=admin_report_command)
+    return parser
+
+def run_command(argv):
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(run_command(sys.argv[1:]))
     main()
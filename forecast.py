@@ -0,0 +1,124 @@
+import os
+from datetime import date
+
+import numpy as np
+
+import storage
+from cache import LRUCache, estimate_size
+
+# Projected income, spending per category and balance for the coming
+# months, computed from the per-month sums in the user's aggregates so a
+# forecast never rescans entries. Income, expense and every category are
+# columns of one months x series matrix and each method is a few NumPy
+# operations over all columns at once. History is the complete months
+# before the current one (gaps count as zero); the forecast covers the
+# current month and the months after it. Results are memoized per user
+# until their data changes or the month turns.
+METHODS = ("moving_average", "exponential", "linear")
+DEFAULT_METHOD = "exponential"
+DEFAULT_HORIZON = 3
+MAX_HORIZON = 24
+HISTORY_MONTHS = 24
+MOVING_AVERAGE_WINDOW = 3
+SMOOTHING_ALPHA = 0.5
+FORECAST_CACHE_MAX_USERS = int(os.environ.get("PFM_FORECAST_CACHE_MAX_USERS", 256))
+
+_memo = LRUCache(FORECAST_CACHE_MAX_USERS, 16 * 1024 * 1024)
+
+
+def _history(month_sums, current):
+    # Returns (series names, T x S matrix) for the months before current.
+    first = current - HISTORY_MONTHS
+    months = {}
+    for key, sums in month_sums.items():
+        month = np.datetime64(key, "M")
+        if first <= month < current:
+            months[month] = sums
+    if not months:
+        return ["income", "expense"], np.zeros((0, 2))
+
+    categories = sorted({category for sums in months.values() for category in sums.get("categories", {})})
+    names = ["income", "expense"] + categories
+    column = {name: i for i, name in enumerate(names)}
+    start = min(months)
+    values = np.zeros(((current - start).astype(int), len(names)))
+    for month, sums in months.items():
+        row = values[(month - start).astype(int)]
+        row[0] = sums.get("income", 0.0)
+        row[1] = sums.get("expense", 0.0)
+        for category, amount in sums.get("categories", {}).items():
+            row[column[category]] = amount
+    return names, values
+
+
+def _moving_average(values, horizon):
+    return np.repeat(values[-MOVING_AVERAGE_WINDOW:].mean(axis=0, keepdims=True), horizon, axis=0)
+
+
+def _exponential(values, horizon):
+    # Simple exponential smoothing from the first month, written out as
+    # its closed-form weights so all series are smoothed in one product.
+    count = len(values)
+    weights = SMOOTHING_ALPHA * (1 - SMOOTHING_ALPHA) ** np.arange(count - 1, -1, -1)
+    weights[0] = (1 - SMOOTHING_ALPHA) ** (count - 1)
+    return np.repeat((weights @ values)[np.newaxis], horizon, axis=0)
+
+
+def _linear(values, horizon):
+    # Least-squares line through each series, extended past the history.
+    count = len(values)
+    if count < 2:
+        return _moving_average(values, horizon)
+    slope, intercept = np.polyfit(np.arange(count), values, 1)
+    steps = np.arange(count, count + horizon)[:, np.newaxis]
+    return np.maximum(slope * steps + intercept, 0.0)
+
+
+_PROJECTIONS = {"moving_average": _moving_average, "exponential": _exponential, "linear": _linear}
+
+
+def project(aggregates, months=DEFAULT_HORIZON, method=DEFAULT_METHOD, today=None):
+    # The forecast for one user's aggregates; see forecast() for the result.
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {', '.join(METHODS)}")
+    if isinstance(months, bool) or not isinstance(months, int) or not 1 <= months <= MAX_HORIZON:
+        raise ValueError(f"months must be between 1 and {MAX_HORIZON}")
+    current = np.datetime64(today or date.today(), "M")
+    names, values = _history(aggregates["months"], current)
+    if len(values):
+        projected = _PROJECTIONS[method](values, months)
+    else:
+        projected = np.zeros((months, len(names)))
+
+    # The current month's projection is for the whole month; only the part
+    # not yet recorded moves the balance.
+    recorded = aggregates["months"].get(str(current), {})
+    net = projected[:, 0] - projected[:, 1]
+    net[0] = max(projected[0, 0] - recorded.get("income", 0.0), 0.0) - \
+        max(projected[0, 1] - recorded.get("expense", 0.0), 0.0)
+    balance = aggregates["total_income"] - aggregates["total_expense"] + np.cumsum(net)
+
+    labels = np.datetime_as_string(current + np.arange(months), unit="M").tolist()
+    projected = projected.round(2)
+    return {
+        "method": method,
+        "history_months": len(values),
+        "months": [{"month": label, "income": float(income), "expense": float(expense), "balance": float(total)}
+                   for label, income, expense, total in zip(labels, projected[:, 0], projected[:, 1],
+                                                           balance.round(2))],
+        "categories": {name: projected[:, i].tolist() for i, name in enumerate(names[2:], start=2)},
+    }
+
+
+def forecast(username, months=DEFAULT_HORIZON, method=DEFAULT_METHOD, today=None):
+    # Returns {"method", "history_months", "months": [{"month", "income",
+    # "expense", "balance"}, ...], "categories": {category: [expense per
+    # month, ...]}}. The result is shared with the memo; do not modify it.
+    today = today or date.today()
+    key = (username, months, method)
+    signature = (storage.data_version(username), today.strftime("%Y-%m"))
+    result = _memo.get(key, signature)
+    if result is None:
+        result = project(storage.load_aggregates(username), months, method, today)
+        _memo.put(key, signature, result, estimate_size(result["months"]) + estimate_size(result["categories"]))
+    return result
@@ -0,0 +1,248 @@
+import csv
+import re
+from collections import Counter
+from datetime import datetime
+from itertools import islice
+
+import storage
+from categorize import load_memo, suggest_categories
+from locking import user_lock
+
+# Bank statement import. Files are read as a stream of transactions and
+# processed CHUNK_SIZE rows at a time, so memory use depends on the number
+# of new entries rather than on the size of the file.
+CHUNK_SIZE = 1000
+
+# A statement uses one date format throughout. Each file starts with all of
+# DATE_FORMATS and drops the ones its dates rule out, so "01/13/2024" settles
+# a file as month-first for every row. Rows whose date the remaining formats
+# disagree on are held back until the format is settled; a file that never
+# settles is rejected unless the caller says which order it uses.
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%m/%d/%Y", "%d-%m-%Y", "%Y/%m/%d", "%d.%m.%Y")
+DAY_FIRST_FORMATS = ("%d/%m/%Y",)
+MONTH_FIRST_FORMATS = ("%m/%d/%Y",)
+
+DATE_COLUMNS = ("date", "transaction date", "posting date", "value date")
+DESCRIPTION_COLUMNS = ("description", "narration", "details", "memo", "payee", "name")
+AMOUNT_COLUMNS = ("amount", "transaction amount")
+DEBIT_COLUMNS = ("debit", "withdrawal", "withdrawal amount")
+CREDIT_COLUMNS = ("credit", "deposit", "deposit amount")
+
+OFX_TAG = re.compile(r"<(/?)([A-Z0-9.]+)>([^<\r\n]*)", re.IGNORECASE)
+
+
+def parse_date(value, formats=DATE_FORMATS):
+    # {format: ISO date} for every format that parses value.
+    value = value.strip()
+    parsed = {}
+    for fmt in formats:
+        try:
+            parsed[fmt] = datetime.strptime(value, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return parsed
+
+
+def date_formats(day_first=None):
+    # The formats a file may use: all of them when the order is unknown.
+    if day_first is None:
+        return DATE_FORMATS
+    excluded = MONTH_FIRST_FORMATS if day_first else DAY_FIRST_FORMATS
+    return tuple(fmt for fmt in DATE_FORMATS if fmt not in excluded)
+
+
+class DateParser:
+    def __init__(self, formats=DATE_FORMATS):
+        self.formats = tuple(formats)
+
+    def parse(self, value):
+        # Returns the ISO date, or None while the file's remaining formats
+        # read value as different dates. Raises ValueError if none of them
+        # parses it.
+        parsed = parse_date(value, self.formats)
+        if not parsed:
+            raise ValueError(f"Unrecognized date: {value.strip()!r}")
+        self.formats = tuple(fmt for fmt in self.formats if fmt in parsed)
+        return self.resolve(value)
+
+    def resolve(self, value):
+        dates = set(parse_date(value, self.formats).values())
+        return dates.pop() if len(dates) == 1 else None
+
+
+def parse_amount(value):
+    value = value.strip().replace(",", "")
+    if value.startswith("(") and value.endswith(")"):
+        value = "-" + value[1:-1]
+    return float(value) if value else 0.0
+
+
+def _find_column(fieldnames, candidates):
+    lowered = {name.strip().lower(): name for name in fieldnames if name}
+    for candidate in candidates:
+        if candidate in lowered:
+            return lowered[candidate]
+    return None
+
+
+def iter_csv_transactions(stream, day_first=None):
+    # Yields (date, description, signed amount); a negative amount is money
+    # going out. Rows that cannot be parsed yield None so they can be counted.
+    # day_first states the order of day and month in the file's dates, for
+    # files where every date could be read either way.
+    reader = csv.DictReader(stream)
+    fieldnames = reader.fieldnames or []
+    date_col = _find_column(fieldnames, DATE_COLUMNS)
+    description_col = _find_column(fieldnames, DESCRIPTION_COLUMNS)
+    amount_col = _find_column(fieldnames, AMOUNT_COLUMNS)
+    debit_col = _find_column(fieldnames, DEBIT_COLUMNS)
+    credit_col = _find_column(fieldnames, CREDIT_COLUMNS)
+    if date_col is None or description_col is None or (amount_col is None and debit_col is None):
+        raise ValueError("CSV needs date, description and amount (or debit/credit) columns.")
+
+    dates = DateParser(date_formats(day_first))
+    # Rows read before the date format was settled: (raw date, description,
+    # amount), flushed in order as soon as every date in them resolves.
+    pending = []
+    for row in reader:
+        # DictReader files fields past the header under None; a row with
+        # anything there does not line up with its columns.
+        if any(value.strip() for value in row.get(None, ())):
+            yield None
+            continue
+        try:
+            if amount_col is not None:
+                amount = parse_amount(row[amount_col] or "")
+            else:
+                credit = row[credit_col] if credit_col else ""
+                amount = parse_amount(credit or "") - parse_amount(row[debit_col] or "")
+            value = row[date_col] or ""
+            date = dates.parse(value)
+        except (ValueError, KeyError):
+            yield None
+            continue
+        description = (row[description_col] or "").strip()
+        if date is not None and not pending:
+            yield date, description, amount
+            continue
+        pending.append((value, description, amount))
+        if date is not None:
+            resolved = [dates.resolve(value) for value, _, _ in pending]
+            if None not in resolved:
+                for date, (_, description, amount) in zip(resolved, pending):
+                    yield date, description, amount
+                pending = []
+    if pending:
+        raise ValueError("Every date in the statement could be day-first or month-first; "
+                         "say which order it uses.")
+
+
+def iter_ofx_transactions(stream):
+    # Handles both SGML (unclosed tags) and XML flavours of OFX by reading
+    # the <STMTTRN> blocks tag by tag.
+    current = None
+    for line in stream:
+        for closing, tag, value in OFX_TAG.findall(line):
+            tag = tag.upper()
+            if tag == "STMTTRN":
+                if not closing:
+                    current = {}
+                elif current is not None:
+                    yield _ofx_transaction(current)
+                    current = None
+            elif current is not None and not closing:
+                current[tag] = value.strip()
+
+
+def _ofx_transaction(fields):
+    try:
+        date = datetime.strptime(fields["DTPOSTED"][:8], "%Y%m%d").strftime("%Y-%m-%d")
+        description = fields.get("NAME") or fields.get("MEMO") or ""
+        return date, description, parse_amount(fields["TRNAMT"])
+    except (ValueError, KeyError):
+        return None
+
+
+def iter_transactions(stream, filename="", day_first=None):
+    first = stream.readline()
+    lines = _prepend(first, stream)
+    if filename.lower().endswith((".ofx", ".qfx")) or first.lstrip().upper().startswith(("OFXHEADER", "<?XML", "<OFX")):
+        return iter_ofx_transactions(lines)
+    return iter_csv_transactions(lines, day_first)
+
+
+def _prepend(first, stream):
+    yield first
+    yield from stream
+
+
+def _fingerprint(kind, date, amount, label):
+    return kind, date, round(amount, 2), label.strip().lower()
+
+
+def _existing_fingerprints(username):
+    income_entries, expense_entries = storage.load_data(username)
+    counts = Counter()
+    for e in income_entries:
+        counts[_fingerprint("income", e.get("date"), e["amount"], e.get("source", ""))] += 1
+    for e in expense_entries:
+        counts[_fingerprint("expense", e.get("date"), e["amount"], e.get("description", ""))] += 1
+    return counts
+
+
+def import_transactions(username, transactions, chunk_size=CHUNK_SIZE):
+    # Entries already in the ledger are matched as a multiset, so importing
+    # the same statement twice adds nothing while two genuinely identical
+    # transactions in one statement are both kept. All new entries are
+    # committed with a single append.
+    with user_lock(username):
+        return _import_transactions(username, transactions, chunk_size)
+
+
+def _import_transactions(username, transactions, chunk_size):
+    existing = _existing_fingerprints(username)
+    rules = storage.load_category_rules(username)
+    memo = load_memo(username)
+    income_entries, expense_entries = [], []
+    result = {"income": 0, "expense": 0, "duplicates": 0, "invalid": 0}
+
+    transactions = iter(transactions)
+    while True:
+        chunk = list(islice(transactions, chunk_size))
+        if not chunk:
+            break
+        valid = [t for t in chunk if t is not None and t[2] != 0]
+        result["invalid"] += len(chunk) - len(valid)
+        expense_descriptions = [description for _, description, amount in valid if amount < 0]
+        categories = iter(suggest_categories(expense_descriptions, rules, memo))
+
+        for date, description, amount in valid:
+            if amount < 0:
+                kind, label, category = "expense", description, next(categories)
+            else:
+                kind, label = "income", description or "Imported"
+            fingerprint = _fingerprint(kind, date, abs(amount), label)
+            if existing[fingerprint] > 0:
+                existing[fingerprint] -= 1
+                result["duplicates"] += 1
+                continue
+            if kind == "income":
+                income_entries.append({"source": label, "amount": amount, "date": date})
+            else:
+                expense_entries.append({
+                    "category": category,
+                    "amount": -amount,
+                    "description": label,
+                    "date": date,
+                })
+            result[kind] += 1
+
+    if income_entries or expense_entries:
+        storage.append_entries(username, income_entries, expense_entries)
+    return result
+
+
+def import_statement(username, stream, filename="", day_first=None):
+    # Raises ValueError, with nothing written, for a statement that cannot
+    # be read as a whole.
+    return import_transactions(username, iter_transactions(stream, filename, day_first))
@@ -0,0 +1,86 @@
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from urllib.parse import quote
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+LOCK_DIR = os.environ.get("PFM_LOCK_DIR", ".locks")
+
+_locks = {}
+_locks_guard = threading.Lock()
+_held = threading.local()
+
+
+def _thread_lock(name):
+    with _locks_guard:
+        lock = _locks.get(name)
+        if lock is None:
+            lock = _locks[name] = threading.RLock()
+        return lock
+
+
+@contextmanager
+def named_lock(name):
+    # Serializes writers across threads (RLock) and across processes
+    # (flock on LOCK_DIR/<name>.lock). Re-entrant within a thread; only the
+    # outermost acquisition takes the file lock.
+    lock = _thread_lock(name)
+    with lock:
+        depth = getattr(_held, "depth", None)
+        if depth is None:
+            depth = _held.depth = {}
+        lock_file = None
+        if depth.get(name, 0) == 0 and fcntl is not None:
+            os.makedirs(LOCK_DIR, exist_ok=True)
+            lock_file = open(os.path.join(LOCK_DIR, f"{safe_filename(name)}.lock"), "a")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        depth[name] = depth.get(name, 0) + 1
+        try:
+            yield
+        finally:
+            depth[name] -= 1
+            if lock_file is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+
+
+def safe_filename(name):
+    # Percent-encodes everything except letters, digits and "_-.~", plus a
+    # leading dot, so any username is one ordinary file name ("a/b" becomes
+    # "a%2Fb", ".." becomes "%2E.") and distinct names never collide.
+    encoded = quote(name, safe="")
+    return "%2E" + encoded[1:] if encoded.startswith(".") else encoded
+
+
+def user_lock(username):
+    return named_lock(f"user-{username}")
+
+
+def users_table_lock():
+    return named_lock("users")
+
+
+def recurring_schedule_lock():
+    return named_lock("recurring-schedule")
+
+
+def atomic_write_json(path, value):
+    # Readers see either the old file or the new one, never a partial dump.
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".json")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(value, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
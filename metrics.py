@@ -0,0 +1,225 @@
+import bisect
+import functools
+import os
+import threading
+import time
+
+# Opt-in instrumentation. With PFM_METRICS=1 storage operations and Flask
+# routes record latency histograms, bytes read and written and entries
+# scanned, rendered in Prometheus text format by render(). Left off,
+# instrumented() returns functions unwrapped and the record_* calls return
+# at once, so there is no cost beyond a flag check.
+ENABLED = os.environ.get("PFM_METRICS", "0") == "1"
+# When set, /metrics requires "Authorization: Bearer <token>".
+METRICS_TOKEN = os.environ.get("PFM_METRICS_TOKEN", "")
+
+# With PFM_PROFILE_SLOW_MS set (and metrics on), PROFILE_SAMPLE_RATE of the
+# requests run under cProfile; the stats of those that took at least that
+# long are written to PROFILE_DIR, keeping the newest PROFILE_KEEP.
+PROFILE_SLOW_MS = float(os.environ.get("PFM_PROFILE_SLOW_MS", 0))
+PROFILE_SAMPLE_RATE = float(os.environ.get("PFM_PROFILE_SAMPLE_RATE", 0.05))
+PROFILE_DIR = os.environ.get("PFM_PROFILE_DIR", "profiles")
+PROFILE_KEEP = int(os.environ.get("PFM_PROFILE_KEEP", 50))
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_HELP = {
+    "pfm_request_duration_seconds": ("histogram", "Flask request latency by route."),
+    "pfm_template_render_seconds": ("histogram", "Template rendering time."),
+    "pfm_storage_duration_seconds": ("histogram", "Storage operation latency."),
+    "pfm_storage_bytes_read_total": ("counter", "Bytes read from disk or SQLite by storage operations."),
+    "pfm_storage_bytes_written_total": ("counter", "Bytes written to disk or SQLite by storage operations."),
+    "pfm_storage_entries_scanned_total": ("counter", "Ledger entries loaded or walked by storage operations."),
+    "pfm_profiles_saved_total": ("counter", "Slow requests whose cProfile stats were saved."),
+}
+
+_lock = threading.Lock()
+_histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+_counters = {}    # (name, labels) -> value
+_current = threading.local()
+
+
+def observe(name, seconds, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    slot = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+        histogram[slot] += 1
+        histogram[-1] += seconds
+
+
+def increment(name, value=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def _current_op():
+    stack = getattr(_current, "ops", None)
+    return stack[-1] if stack else "other"
+
+
+# Called from the storage layer; the amount is charged to the innermost
+# instrumented operation running on this thread.
+def record_bytes_read(nbytes):
+    if ENABLED:
+        increment("pfm_storage_bytes_read_total", nbytes, op=_current_op())
+
+
+def record_bytes_written(nbytes):
+    if ENABLED:
+        increment("pfm_storage_bytes_written_total", nbytes, op=_current_op())
+
+
+def record_entries_scanned(count):
+    if ENABLED:
+        increment("pfm_storage_entries_scanned_total", count, op=_current_op())
+
+
+def instrumented(op):
+    # Decorator for storage functions: times each call as op.
+    def decorate(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            stack = getattr(_current, "ops", None)
+            if stack is None:
+                stack = _current.ops = []
+            stack.append(op)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe("pfm_storage_duration_seconds", time.perf_counter() - start, op=op)
+                stack.pop()
+        return wrapper
+    return decorate
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def render():
+    with _lock:
+        histograms = {key: list(value) for key, value in _histograms.items()}
+        counters = dict(_counters)
+    lines = []
+    for name, (kind, help_text) in _HELP.items():
+        series = histograms if kind == "histogram" else counters
+        keys = sorted(key for key in series if key[0] == name)
+        if not keys:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for key in keys:
+            labels = key[1]
+            if kind == "counter":
+                lines.append(f"{name}{_format_labels(labels)} {series[key]}")
+                continue
+            counts = series[key]
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {counts[-1]}")
+            lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+
+
+def init_app(app):
+    # Request and template timing hooks; the /metrics route itself lives in
+    # app.py with the other routes.
+    if not ENABLED:
+        return
+    import random
+
+    from flask import before_render_template, g, request, template_rendered
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_start = time.perf_counter()
+        g.metrics_profile = None
+        if PROFILE_SLOW_MS > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            import cProfile
+
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+                g.metrics_profile = profile
+            except ValueError:
+                # Another profiler is already active.
+                pass
+
+    @app.after_request
+    def _record_request(response):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        observe("pfm_request_duration_seconds", elapsed,
+                route=route, method=request.method, status=response.status_code)
+        profile = g.pop("metrics_profile", None)
+        if profile is not None:
+            profile.disable()
+            if elapsed * 1000 >= PROFILE_SLOW_MS:
+                _save_profile(profile, route, elapsed)
+        return response
+
+    @app.teardown_request
+    def _stop_profile(exc):
+        # A request that failed before after_request ran.
+        profile = g.pop("metrics_profile", None)
+        if profile is not None:
+            profile.disable()
+
+    def _template_started(sender, template, context, **extra):
+        g.metrics_template_start = time.perf_counter()
+
+    def _template_done(sender, template, context, **extra):
+        start = g.pop("metrics_template_start", None)
+        if start is not None:
+            observe("pfm_template_render_seconds", time.perf_counter() - start, template=template.name)
+
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_done, app)
+
+
+def _save_profile(profile, route, elapsed):
+    import io
+    import pstats
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    slug = "".join(c if c.isalnum() else "_" for c in route).strip("_") or "root"
+    base = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{slug}-{elapsed * 1000:.0f}ms")
+    # .prof for snakeviz/pstats, .txt for reading on the server.
+    profile.dump_stats(base + ".prof")
+    text = io.StringIO()
+    pstats.Stats(profile, stream=text).sort_stats("cumulative").print_stats(40)
+    with open(base + ".txt", "w") as f:
+        f.write(text.getvalue())
+    increment("pfm_profiles_saved_total", route=route)
+
+    saved = sorted((entry.stat().st_mtime_ns, entry.path)
+                   for entry in os.scandir(PROFILE_DIR) if entry.name.endswith(".prof"))
+    for _, path in saved[:-PROFILE_KEEP] if PROFILE_KEEP > 0 else saved:
+        for stale in (path, path[:-len(".prof")] + ".txt"):
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
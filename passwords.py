@@ -0,0 +1,103 @@
+import hashlib
+import hmac
+import os
+import threading
+
+# Passwords are stored as "scrypt$<n>$<r>$<p>$<salt hex>$<hash hex>". Older
+# accounts hold a bare SHA-256 hex digest; those still verify and are
+# rehashed on the next successful login.
+SCRYPT_N = int(os.environ.get("PFM_SCRYPT_N", 2 ** 14))
+SCRYPT_R = int(os.environ.get("PFM_SCRYPT_R", 8))
+SCRYPT_P = int(os.environ.get("PFM_SCRYPT_P", 1))
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+# scrypt needs about 128 * n * r bytes per call, so the pool size bounds
+# both CPU and memory spent on logins at any moment. Pooled calls are only
+# admitted while a worker is free, so nothing queues behind a saturated
+# pool: a caller either starts hashing at once or is turned away.
+HASH_WORKERS = int(os.environ.get("PFM_HASH_WORKERS", os.cpu_count() or 2))
+VERIFY_TIMEOUT = float(os.environ.get("PFM_VERIFY_TIMEOUT", 10))
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(HASH_WORKERS)
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=128 * r * (n + p + 2) + 1024 * 1024, dklen=HASH_BYTES)
+
+
+def hash_password(password, n=None, r=None, p=None):
+    n, r, p = n or SCRYPT_N, r or SCRYPT_R, p or SCRYPT_P
+    salt = os.urandom(SALT_BYTES)
+    return f"scrypt${n}${r}${p}${salt.hex()}${_scrypt(password, salt, n, r, p).hex()}"
+
+
+def is_legacy_hash(stored):
+    return "$" not in stored
+
+
+def verify_password(password, stored):
+    if is_legacy_hash(stored):
+        candidate = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(candidate, stored)
+    try:
+        _, n, r, p, salt, expected = stored.split("$")
+        expected = bytes.fromhex(expected)
+        candidate = _scrypt(password, bytes.fromhex(salt), int(n), int(r), int(p))
+    except ValueError:
+        return False
+    return hmac.compare_digest(candidate, expected)
+
+
+def needs_rehash(stored):
+    return is_legacy_hash(stored) or not stored.startswith(f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}$")
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Imported here: the CLI only hashes inline and skips this import.
+            from concurrent.futures import ThreadPoolExecutor
+
+            _pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="password-hash")
+        return _pool
+
+
+def _run_pooled(timeout, function, *args):
+    # Raises concurrent.futures.TimeoutError at once when every worker is
+    # busy, or after the timeout. The slot is held until the work itself
+    # finishes, so timed-out callers cannot push the pool past its bound.
+    from concurrent.futures import TimeoutError
+
+    if not _slots.acquire(blocking=False):
+        raise TimeoutError("All password-hashing workers are busy.")
+    try:
+        future = _get_pool().submit(function, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=VERIFY_TIMEOUT if timeout is None else timeout)
+    except TimeoutError:
+        future.cancel()
+        raise
+
+
+def verify_password_pooled(password, stored, timeout=None):
+    # hashlib.scrypt releases the GIL, so verifications in the pool run in
+    # parallel with each other and with request handling.
+    return _run_pooled(timeout, verify_password, password, stored)
+
+
+def hash_password_pooled(password, timeout=None):
+    return _run_pooled(timeout, hash_password, password)
+
+
+def hash_passwords_pooled(passwords):
+    # Bulk resets: hashes the passwords in parallel, results in input order.
+    return list(_get_pool().map(hash_password, passwords))
@@ -0,0 +1,257 @@
+import heapq
+import os
+import secrets
+from calendar import monthrange
+from datetime import date, datetime, timedelta
+from itertools import islice
+
+import storage
+from batch import validate_op
+from categorize import load_memo
+from locking import recurring_schedule_lock, user_lock
+
+# Recurring income and expenses (rent, salaries, subscriptions). Rules live
+# in each user's "recurring" document and are expanded lazily into ordinary
+# ledger entries: every occurrence up to today that has not been generated
+# yet is appended, in one batch with the rules' new positions, whenever the
+# user's data is accessed (expand_due) or by the nightly run_due() pass.
+# The shared schedule maps each user with a pending rule to a date no later
+# than the earliest one falls due; run_due() orders it as a min-heap and
+# only touches the users at the top, so a night with nothing due reads no
+# user data. Expanding a rule only moves its due date later, so expansion
+# leaves the schedule alone: an entry that has fallen behind costs run_due
+# one look at the user's rules, and run_due corrects all of them in a
+# single write at the end. Only add_rule moves entries earlier.
+#
+# A rule repeats every `interval` days, weeks or months; "custom" is every
+# `interval` days. Monthly rules keep the start's day of the month, moved
+# back to the last day in shorter months.
+FREQUENCIES = ("daily", "weekly", "monthly", "custom")
+_STEP_DAYS = {"daily": 1, "weekly": 7, "custom": 1}
+
+# Occurrences written per rule in one pass, so a rule started far in the
+# past cannot turn one request into an unbounded write. A rule still behind
+# afterwards stays due and catches up on the next pass.
+MAX_OCCURRENCES = int(os.environ.get("PFM_RECURRING_MAX_OCCURRENCES", 1000))
+
+# username -> the day expand_due last found nothing left to do. New rules
+# are expanded by add_rule itself, so until the date changes there is
+# nothing for expand_due to find.
+_expanded = {}
+
+
+def _parse_date(value, field):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be YYYY-MM-DD")
+
+
+def _add_months(day, months):
+    year, month = divmod(day.month - 1 + months, 12)
+    year += day.year
+    return day.replace(year=year, month=month + 1, day=min(day.day, monthrange(year, month + 1)[1]))
+
+
+def make_rule(op, rules=None, memo=None):
+    # Validates a rule definition: the fields of an income or expense
+    # operation (see batch.validate_op), with "start" in place of "date",
+    # plus "frequency", "interval" (default 1, required for custom) and an
+    # optional inclusive "end". Returns the rule without its id, or raises
+    # ValueError.
+    if not isinstance(op, dict):
+        raise ValueError("rule must be an object")
+    if op.get("type") not in ("income", "expense"):
+        raise ValueError("type must be income or expense")
+    entry_type, entry = validate_op(dict(op, date=op.get("start")), rules, memo)
+    start = entry.pop("date")
+
+    frequency = op.get("frequency")
+    if frequency not in FREQUENCIES:
+        raise ValueError(f"frequency must be one of {', '.join(FREQUENCIES)}")
+    interval = op.get("interval")
+    if interval is None and frequency != "custom":
+        interval = 1
+    if isinstance(interval, bool) or not isinstance(interval, int) or interval < 1:
+        raise ValueError("interval must be a whole number of at least 1")
+
+    end = op.get("end")
+    if end is not None:
+        end = _parse_date(end, "end").isoformat()
+        if end < start:
+            raise ValueError("end cannot be before start")
+    return {
+        "type": entry_type,
+        "entry": entry,
+        "frequency": frequency,
+        "interval": interval,
+        "start": start,
+        "end": end,
+        "generated": 0,
+        "next_due": start,
+    }
+
+
+def occurrence(rule, index):
+    # Date of the rule's index-th occurrence, counting from 0 at start.
+    start = date.fromisoformat(rule["start"])
+    steps = index * rule["interval"]
+    if rule["frequency"] == "monthly":
+        return _add_months(start, steps)
+    return start + timedelta(days=steps * _STEP_DAYS[rule["frequency"]])
+
+
+def occurrences(rule, until):
+    # Yields the dates of the occurrences not generated yet, up to and
+    # including until (and the rule's end). Lazy, so callers can stop early.
+    end = date.fromisoformat(rule["end"]) if rule.get("end") else None
+    index = rule["generated"]
+    while True:
+        when = occurrence(rule, index)
+        if when > until or (end is not None and when > end):
+            return
+        yield when
+        index += 1
+
+
+def _next_due(rule):
+    when = occurrence(rule, rule["generated"])
+    if rule.get("end") and when.isoformat() > rule["end"]:
+        return None
+    return when.isoformat()
+
+
+def _earliest_due(rules):
+    return min((rule["next_due"] for rule in rules.values() if rule["next_due"]), default=None)
+
+
+def _schedule_earlier(username, due):
+    # Makes sure run_due looks at the user by `due`.
+    if due is None:
+        return
+    with recurring_schedule_lock():
+        schedule = storage.load_recurring_schedule()
+        if username in schedule and schedule[username] <= due:
+            return
+        schedule[username] = due
+        storage.save_recurring_schedule(schedule)
+
+
+def _expand(username, today):
+    # Returns (entries written, the user's earliest next due date or None).
+    with user_lock(username):
+        rules = storage.load_recurring_rules(username)
+        income, expense = [], []
+        for rule_id, rule in rules.items():
+            generated = income if rule["type"] == "income" else expense
+            for when in islice(occurrences(rule, today), MAX_OCCURRENCES):
+                generated.append(dict(rule["entry"], date=when.isoformat(), recurring=rule_id))
+                rule["generated"] += 1
+            rule["next_due"] = _next_due(rule)
+        if income or expense:
+            storage.append_recurring(username, income, expense, rules)
+        due = _earliest_due(rules)
+    if due is None or due > today.isoformat():
+        _expanded[username] = today
+    return len(income) + len(expense), due
+
+
+def materialize(username, today=None):
+    # Writes every occurrence of the user's rules due up to today. Returns
+    # the number of entries written.
+    return _expand(username, today or date.today())[0]
+
+
+def expand_due(username, today=None):
+    # For every access to a user's data: returns 0 without touching storage
+    # once the user is up to date for the day.
+    today = today or date.today()
+    if _expanded.get(username) == today:
+        return 0
+    rules = storage.load_recurring_rules(username)
+    if any(rule["next_due"] and rule["next_due"] <= today.isoformat() for rule in rules.values()):
+        return materialize(username, today)
+    _expanded[username] = today
+    return 0
+
+
+def load_rules(username):
+    # {rule id: rule}
+    return storage.load_recurring_rules(username)
+
+
+def add_rule(username, op, today=None):
+    # Stores a new rule and writes any occurrences already due. Returns
+    # (rule id, rule, entries written); raises ValueError for an invalid
+    # definition.
+    with user_lock(username):
+        rules = storage.load_recurring_rules(username)
+        rule = make_rule(op, storage.load_category_rules(username), load_memo(username))
+        rule_id = secrets.token_hex(4)
+        while rule_id in rules:
+            rule_id = secrets.token_hex(4)
+        rules[rule_id] = rule
+        storage.save_recurring_rules(username, rules)
+        written, due = _expand(username, today or date.today())
+        _schedule_earlier(username, due)
+        return rule_id, storage.load_recurring_rules(username)[rule_id], written
+
+
+def delete_rule(username, rule_id):
+    # Stops a rule; entries it already generated stay in the ledger.
+    # Returns False if there is no such rule.
+    with user_lock(username):
+        rules = storage.load_recurring_rules(username)
+        if rules.pop(rule_id, None) is None:
+            return False
+        storage.save_recurring_rules(username, rules)
+        return True
+
+
+def run_due(today=None):
+    # The nightly pass over all users. Returns (users expanded, entries
+    # written).
+    today = today or date.today()
+    cutoff = today.isoformat()
+    started = storage.load_recurring_schedule()
+    heap = [(due, username) for username, due in started.items()]
+    heapq.heapify(heap)
+    updates, written = {}, 0
+    while heap and heap[0][0] <= cutoff:
+        _, username = heapq.heappop(heap)
+        count, due = _expand(username, today)
+        updates[username] = due
+        written += count
+        if due is not None and due <= cutoff:
+            # Held back by MAX_OCCURRENCES; each pass makes progress.
+            heapq.heappush(heap, (due, username))
+    if updates:
+        with recurring_schedule_lock():
+            schedule = storage.load_recurring_schedule()
+            for username, due in updates.items():
+                current = schedule.get(username)
+                if current != started.get(username) and current is not None:
+                    # add_rule moved the user earlier while we ran.
+                    due = min(current, due) if due else current
+                if due is None:
+                    schedule.pop(username, None)
+                else:
+                    schedule[username] = due
+            storage.save_recurring_schedule(schedule)
+    return len(updates), written
+
+
+def rebuild_schedule(usernames=None):
+    # Recomputes the shared schedule from every user's rules, e.g. after
+    # restoring user files from a backup. Returns the number of users with
+    # a pending rule.
+    if usernames is None:
+        usernames = storage.load_users()
+    schedule = {}
+    for username in usernames:
+        due = [rule["next_due"] for rule in storage.load_recurring_rules(username).values() if rule["next_due"]]
+        if due:
+            schedule[username] = min(due)
+    with recurring_schedule_lock():
+        storage.save_recurring_schedule(schedule)
+    return len(schedule)
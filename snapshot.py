@@ -0,0 +1,120 @@
+import itertools
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+import metrics
+from entries import Entry
+
+# Binary snapshot of a ledger, so a cold load does not have to parse the
+# whole JSON history. The file is SNAPSHOT_MAGIC, a length-prefixed JSON
+# header (caller metadata, the label and category tables, extra entry keys),
+# then one fixed-size record per entry, income first. Reading memory-maps
+# the file and unpacks the records with struct, with no per-entry JSON or
+# date parsing. Snapshots are a cache: a missing, truncated or unreadable
+# file reads as None and the caller falls back to the JSON files.
+SNAPSHOT_MAGIC = b"PFMSNAP1"
+
+_HEADER_LENGTH = struct.Struct("<I")
+# flags, day ordinal, label, category (-1 for None), extra (-1 for None), amount
+_RECORD = struct.Struct("<BiIiid")
+_EXPENSE = 1
+_INT_AMOUNT = 2
+_MAX_EXACT_INT = 2 ** 53
+
+
+def _packable(entry):
+    amount = entry.amount
+    if not (type(amount) is float or (type(amount) is int and abs(amount) < _MAX_EXACT_INT)):
+        return False
+    return isinstance(entry.label, str) and (entry.category is None or isinstance(entry.category, str))
+
+
+def write_snapshot(path, income_entries, expense_entries, meta):
+    # Returns False, writing nothing, if an entry holds values the record
+    # format cannot represent exactly.
+    labels, categories, extras = {}, {}, []
+
+    def ref(table, value):
+        index = table.get(value)
+        if index is None:
+            index = table[value] = len(table)
+        return index
+
+    records = bytearray()
+    for entry in itertools.chain(income_entries, expense_entries):
+        if not _packable(entry):
+            return False
+        flags = (_EXPENSE if entry.kind == "expense" else 0) | (_INT_AMOUNT if type(entry.amount) is int else 0)
+        category = -1 if entry.category is None else ref(categories, entry.category)
+        extra = -1
+        if entry.extra:
+            extra = len(extras)
+            extras.append(entry.extra)
+        records += _RECORD.pack(flags, entry.day, ref(labels, entry.label), category, extra, entry.amount)
+
+    header = json.dumps({
+        "meta": meta,
+        "income": len(income_entries),
+        "expense": len(expense_entries),
+        "labels": list(labels),
+        "categories": list(categories),
+        "extras": extras,
+    }).encode()
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-", suffix=".snap")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(SNAPSHOT_MAGIC + _HEADER_LENGTH.pack(len(header)) + header)
+            f.write(records)
+        os.replace(tmp_path, path)
+        metrics.record_bytes_written(len(SNAPSHOT_MAGIC) + _HEADER_LENGTH.size + len(header) + len(records))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return True
+
+
+def read_snapshot(path):
+    # Returns (meta, income entries, expense entries) or None.
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return _parse(mm)
+    except (OSError, ValueError, KeyError, IndexError, struct.error):
+        # OSError covers a missing file, ValueError an empty one (mmap) or a
+        # bad header.
+        return None
+
+
+def _parse(mm):
+    start = len(SNAPSHOT_MAGIC) + _HEADER_LENGTH.size
+    if mm[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+        return None
+    (header_length,) = _HEADER_LENGTH.unpack_from(mm, len(SNAPSHOT_MAGIC))
+    header = json.loads(mm[start:start + header_length])
+    start += header_length
+    count = header["income"] + header["expense"]
+    if len(mm) != start + count * _RECORD.size:
+        return None
+    metrics.record_bytes_read(len(mm))
+
+    labels = header["labels"]
+    categories = [sys.intern(value) for value in header["categories"]]
+    extras = header["extras"]
+    with memoryview(mm) as view, view[start:] as records:
+        rows = list(_RECORD.iter_unpack(records))
+    entries = [
+        Entry("expense" if flags & _EXPENSE else "income",
+              int(amount) if flags & _INT_AMOUNT else amount,
+              day,
+              labels[label],
+              None if category < 0 else categories[category],
+              None if extra < 0 else extras[extra])
+        for flags, day, label, category, extra, amount in rows
+    ]
+    return header["meta"], entries[:header["income"]], entries[header["income"]:]
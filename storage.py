@@ -0,0 +1,1241 @@
+import base64
+import bisect
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+import metrics
+from aggregates import AGGREGATES_SCHEMA, apply_entries, build_aggregates
+from cache import LRUCache, estimate_size
+from entries import Entry, estimate_entries_size, from_dicts, to_dicts
+from locking import atomic_write_json, safe_filename, user_lock, users_table_lock
+from snapshot import read_snapshot, write_snapshot
+
+# "json" rewrites the per-user income/expense files on every change.
+# "log" appends one JSON line per transaction to {username}_ledger.jsonl and
+# folds that log back into the JSON files once it grows past
+# LOG_COMPACT_BYTES, so a single insert no longer costs O(history).
+# "sqlite" keeps every user in one WAL-mode database at SQLITE_PATH.
+STORAGE_MODE = os.environ.get("PFM_STORAGE", "json")
+LOG_COMPACT_BYTES = int(os.environ.get("PFM_LOG_COMPACT_BYTES", 1024 * 1024))
+SQLITE_PATH = os.environ.get("PFM_SQLITE_PATH", "finance.db")
+
+# Parsed ledgers and the user table are kept in an in-process LRU cache and
+# revalidated against the backend's data signature on every read.
+CACHE_MAX_USERS = int(os.environ.get("PFM_CACHE_MAX_USERS", 256))
+CACHE_MAX_BYTES = int(os.environ.get("PFM_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+# With group commit, appends for a user that arrive while another append is
+# being written are merged and committed together with a single fsync.
+GROUP_COMMIT = os.environ.get("PFM_GROUP_COMMIT", "0") == "1"
+
+# File backends keep a binary snapshot of ledgers with at least
+# SNAPSHOT_MIN_ENTRIES entries next to the JSON files. Writers only delete
+# it; the next load that has to parse the JSON files writes a fresh one. In
+# log mode a load that had to replay more than SNAPSHOT_TAIL_ENTRIES log
+# lines past the snapshot also writes a fresh one, so cold loads only parse
+# recent activity.
+SNAPSHOT_MIN_ENTRIES = int(os.environ.get("PFM_SNAPSHOT_MIN_ENTRIES", 1000))
+SNAPSHOT_TAIL_ENTRIES = int(os.environ.get("PFM_SNAPSHOT_TAIL_ENTRIES", 1000))
+
+# migrate_layout() waits this long after switching users to the sharded
+# layout before deleting their flat files, for readers that resolved a flat
+# path just before the switch.
+MIGRATION_GRACE_SECONDS = float(os.environ.get("PFM_MIGRATION_GRACE_SECONDS", 5))
+
+# Every write gets the next number in a per-user change sequence; the most
+# recent CHANGE_LOG_LIMIT changes are kept so clients can fetch deltas. The
+# "changes" document only holds the latest number. The changes themselves
+# are appended to {username}_changes.jsonl (rewritten with the newest
+# CHANGE_LOG_LIMIT lines whenever the sequence passes a multiple of it) or
+# to the SQLite changes table, trimmed in the same transaction.
+CHANGE_LOG_LIMIT = int(os.environ.get("PFM_CHANGE_LOG_LIMIT", 1000))
+
+# File backends keep users.json in DATA_DIR and each user's files in
+# DATA_DIR/<ab>/<cd>/<encoded username>/, where abcd are the first hex digits
+# of the SHA-256 of the username, so no directory grows with the user count.
+# Files from the old flat layout (<username>_income.json and so on in
+# LEGACY_DATA_DIR) are used until migrate_layout() moves them; users without
+# any get the sharded layout straight away.
+DATA_DIR = os.environ.get("PFM_DATA_DIR", "data")
+LEGACY_DATA_DIR = os.environ.get("PFM_LEGACY_DATA_DIR", ".")
+USERS_FILENAME = "users.json"
+# Documents shared by all users, kept in DATA_DIR (or, on SQLite, in the
+# docs table under the empty user name).
+SCHEDULE_DOC = "recurring_schedule"
+
+# Per-user documents stored next to the ledger by every backend.
+USER_DOCS = ("budgets", "aggregates", "category_rules", "category_memo", "changes", "recurring")
+
+# Every file a file backend may keep for one user.
+USER_FILES = ("income.json", "expense.json", "ledger.jsonl", "ledger.snap", "changes.jsonl",
+              "ledger.folded.jsonl", "ledger.folded.json") + tuple(f"{name}.json" for name in USER_DOCS)
+
+# Users known to have a sharded directory. Directories are only removed by
+# delete_user, so a hit saves the legacy-layout probe on every path lookup.
+_sharded_users = set()
+
+
+def get_user_dir(username):
+    digest = hashlib.sha256(username.encode()).hexdigest()
+    return os.path.join(DATA_DIR, digest[:2], digest[2:4], safe_filename(username))
+
+
+def _legacy_path(username, name):
+    return os.path.join(LEGACY_DATA_DIR, f"{username}_{name}")
+
+
+def _uses_legacy_layout(username):
+    if username in _sharded_users:
+        return False
+    if os.path.isdir(get_user_dir(username)):
+        _sharded_users.add(username)
+        return False
+    return any(os.path.exists(_legacy_path(username, name)) for name in USER_FILES)
+
+
+def get_user_file(username, name):
+    if _uses_legacy_layout(username):
+        return _legacy_path(username, name)
+    return os.path.join(get_user_dir(username), name)
+
+
+def get_users_filename():
+    path = os.path.join(DATA_DIR, USERS_FILENAME)
+    legacy = os.path.join(LEGACY_DATA_DIR, USERS_FILENAME)
+    if not os.path.exists(path) and os.path.exists(legacy):
+        return legacy
+    return path
+
+
+def get_data_filenames(username):
+    return tuple(get_user_file(username, name) for name in ("income.json", "expense.json", "budgets.json"))
+
+
+def get_log_filename(username):
+    return get_user_file(username, "ledger.jsonl")
+
+
+def get_folded_log_filenames(username):
+    # The log set aside while it is folded into the JSON files, and the
+    # identities those files had before (see LogStorage.save_entries).
+    return get_user_file(username, "ledger.folded.jsonl"), get_user_file(username, "ledger.folded.json")
+
+
+def get_snapshot_filename(username):
+    return get_user_file(username, "ledger.snap")
+
+
+def get_changes_filename(username):
+    return get_user_file(username, "changes.jsonl")
+
+
+def get_doc_filename(username, name):
+    return get_user_file(username, f"{name}.json")
+
+
+def _read_json(path, default):
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            if metrics.ENABLED:
+                metrics.record_bytes_read(os.fstat(f.fileno()).st_size)
+            return json.load(f)
+    return default
+
+
+def _read_json_list(path):
+    return _read_json(path, [])
+
+
+def _stat_signature(paths):
+    signature = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            signature.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def _file_identities(paths):
+    # Unlike _stat_signature this includes the inode, which every atomic
+    # rewrite changes, so it tells whether a file has been replaced.
+    identities = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            identities.append([st.st_ino, st.st_mtime_ns, st.st_size])
+        except FileNotFoundError:
+            identities.append(None)
+    return identities
+
+
+def _base_signature(username):
+    # The JSON files' signature in the form it takes in a snapshot header.
+    return [list(sig) if sig else None for sig in _stat_signature(get_data_filenames(username)[:2])]
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _append_lines(path, lines):
+    # Appends the lines with one fsync and returns the file's new size. A
+    # crash mid-append can leave a partial last line; it is cut off first,
+    # so the next line is not glued onto it and lost along with it.
+    data = "".join(lines).encode()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a+b") as f:
+        size = f.seek(0, os.SEEK_END)
+        if size:
+            f.seek(size - 1)
+            if f.read(1) != b"\n":
+                f.truncate(_last_line_end(f, size))
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+        size = f.tell()
+    metrics.record_bytes_written(len(data))
+    return size
+
+
+def _last_line_end(f, size):
+    # Offset just past the last newline in the first `size` bytes of f.
+    position = size
+    while position > 0:
+        start = max(0, position - 4096)
+        f.seek(start)
+        index = f.read(position - start).rfind(b"\n")
+        if index >= 0:
+            return start + index + 1
+        position = start
+    return 0
+
+
+def _write_lines(path, lines):
+    # Replaces the file atomically, like atomic_write_json.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-", suffix=".jsonl")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if metrics.ENABLED:
+        metrics.record_bytes_written(os.path.getsize(path))
+
+
+def _write_json(path, value):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    atomic_write_json(path, value)
+    if metrics.ENABLED:
+        metrics.record_bytes_written(os.path.getsize(path))
+
+
+class JsonStorage:
+    def load_users(self):
+        return _read_json(get_users_filename(), {})
+
+    def save_users(self, users):
+        _write_json(get_users_filename(), users)
+
+    def users_signature(self):
+        return _stat_signature([get_users_filename()])
+
+    def data_signature(self, username):
+        return _stat_signature(get_data_filenames(username)[:2])
+
+    def changes_signature(self, username):
+        return _stat_signature([get_doc_filename(username, "changes"), get_changes_filename(username)])
+
+    def load_entries(self, username):
+        income_file, expense_file, _ = get_data_filenames(username)
+        return _read_json_list(income_file), _read_json_list(expense_file)
+
+    def load_ledger(self, username):
+        # Entry lists for storage.load_data.
+        base = _base_signature(username)
+        income, expense, offset = self._load_base(username)
+        if offset is None:
+            self._refresh_snapshot(username, base, income, expense, 0)
+        return income, expense
+
+    def _load_base(self, username):
+        # Returns (income, expense, log offset) for the JSON files, from the
+        # snapshot when it was written for exactly these files. The offset
+        # is how much of the ledger log the snapshot already includes, None
+        # when the JSON files had to be parsed.
+        snapshot = read_snapshot(get_snapshot_filename(username))
+        if snapshot is not None and snapshot[0].get("base") == _base_signature(username):
+            meta, income, expense = snapshot
+            return income, expense, meta.get("log_offset", 0)
+        income, expense = JsonStorage.load_entries(self, username)
+        return from_dicts("income", income), from_dicts("expense", expense), None
+
+    def _refresh_snapshot(self, username, base, income, expense, log_offset):
+        # For readers: base is the signature taken before the files were
+        # read, and nothing is written if a writer has replaced them since.
+        if len(income) + len(expense) < SNAPSHOT_MIN_ENTRIES:
+            return
+        with user_lock(username):
+            if _base_signature(username) == base:
+                write_snapshot(get_snapshot_filename(username), income, expense,
+                               {"base": base, "log_offset": log_offset})
+
+    def save_entries(self, username, income_entries, expense_entries):
+        # The old snapshot goes first, so a crash part way through never
+        # leaves one describing files that have since changed. Readers write
+        # the new one, so a run of appends does not rebuild it every time.
+        _remove(get_snapshot_filename(username))
+        income_file, expense_file, _ = get_data_filenames(username)
+        _write_json(income_file, income_entries)
+        _write_json(expense_file, expense_entries)
+
+    def append_entries(self, username, income_entries=(), expense_entries=()):
+        income, expense = self.load_entries(username)
+        income.extend(income_entries)
+        expense.extend(expense_entries)
+        self.save_entries(username, income, expense)
+
+    def write_batch(self, username, income_entries, expense_entries, docs, changes=()):
+        # Separate files cannot be replaced atomically as a group; callers
+        # hold the user lock so no other writer interleaves.
+        if income_entries or expense_entries:
+            self.append_entries(username, income_entries, expense_entries)
+        self.append_changes(username, changes)
+        for name, value in docs.items():
+            self.save_doc(username, name, value)
+
+    def load_changes(self, username, seq):
+        # The newest CHANGE_LOG_LIMIT changes numbered up to seq.
+        records = []
+        try:
+            f = open(get_changes_filename(username), "rb")
+        except FileNotFoundError:
+            return records
+        with f:
+            data = f.read()
+        metrics.record_bytes_read(len(data))
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            # A crash after appending a batch's lines but before saving its
+            # "changes" document leaves lines the next batch numbers again;
+            # the later ones win.
+            while records and records[-1]["seq"] >= record["seq"]:
+                records.pop()
+            records.append(record)
+        return [record for record in records if record["seq"] <= seq][-CHANGE_LOG_LIMIT:]
+
+    def append_changes(self, username, changes):
+        if not changes:
+            return
+        path = get_changes_filename(username)
+        _append_lines(path, [json.dumps(change) + "\n" for change in changes])
+        last = changes[-1]["seq"]
+        if last // CHANGE_LOG_LIMIT > (changes[0]["seq"] - 1) // CHANGE_LOG_LIMIT:
+            kept = self.load_changes(username, last)
+            _write_lines(path, [json.dumps(change) + "\n" for change in kept])
+
+    def load_doc(self, username, name, default=None):
+        return _read_json(get_doc_filename(username, name), default)
+
+    def save_doc(self, username, name, value):
+        _write_json(get_doc_filename(username, name), value)
+
+    def load_shared_doc(self, name, default=None):
+        return _read_json(os.path.join(DATA_DIR, f"{name}.json"), default)
+
+    def save_shared_doc(self, name, value):
+        _write_json(os.path.join(DATA_DIR, f"{name}.json"), value)
+
+    def delete_user(self, username):
+        paths = get_data_filenames(username)[:2] + tuple(get_doc_filename(username, name) for name in USER_DOCS)
+        for path in paths + (get_snapshot_filename(username), get_changes_filename(username)):
+            if os.path.exists(path):
+                os.remove(path)
+        if not _uses_legacy_layout(username):
+            _sharded_users.discard(username)
+            try:
+                os.rmdir(get_user_dir(username))
+            except OSError:
+                pass
+
+
+class LogStorage(JsonStorage):
+    # The JSON files written by JsonStorage are the compacted base and the
+    # log is the tail replayed on top of it. Existing users therefore need
+    # no conversion when switching to this mode, and compact() leaves files
+    # that JsonStorage reads as-is when switching back.
+
+    def load_entries(self, username):
+        income, expense = self._load_folded(username)
+        for kind, entry in self._read_log(username)[0]:
+            (income if kind == "income" else expense).append(entry)
+        return income, expense
+
+    def _load_folded(self, username):
+        # The JSON files plus the part of a set-aside log they do not hold
+        # yet: its entries of each kind whose file has not been replaced
+        # since the log was set aside.
+        income_file, expense_file, _ = get_data_filenames(username)
+        folded_log, folded_meta = get_folded_log_filenames(username)
+        meta = _read_json(folded_meta, None) if os.path.exists(folded_log) else None
+        current = _file_identities([income_file, expense_file])
+        income, expense = super().load_entries(username)
+        if meta is not None:
+            pending = {kind for kind, before, now in zip(("income", "expense"), meta["base"], current) if before == now}
+            for kind, entry in self._read_log(username, path=folded_log)[0]:
+                if kind in pending:
+                    (income if kind == "income" else expense).append(entry)
+        return income, expense
+
+    def load_ledger(self, username):
+        # The snapshot (or JSON base) plus only the log lines written after
+        # it, with the snapshot moved forward when that tail gets long.
+        if os.path.exists(get_folded_log_filenames(username)[0]):
+            # An interrupted fold, which no snapshot describes; the next
+            # save_entries finishes it.
+            income, expense = self.load_entries(username)
+            return from_dicts("income", income), from_dicts("expense", expense)
+        base = _base_signature(username)
+        income, expense, offset = self._load_base(username)
+        tail, end = self._read_log(username, offset or 0)
+        if tail is None:
+            # The log no longer extends the snapshot; start from the files.
+            income, expense = JsonStorage.load_entries(self, username)
+            income, expense, offset = from_dicts("income", income), from_dicts("expense", expense), None
+            tail, end = self._read_log(username)
+        labels = {}
+        for kind, entry in tail:
+            (income if kind == "income" else expense).append(Entry.from_dict(kind, entry, labels))
+        if offset is None or len(tail) > SNAPSHOT_TAIL_ENTRIES:
+            self._refresh_snapshot(username, base, income, expense, end)
+        return income, expense
+
+    def save_entries(self, username, income_entries, expense_entries):
+        # The JSON files and the log cannot be replaced together, so the log
+        # is first renamed aside, with the JSON files' identities noted
+        # beforehand. Until the set-aside log is deleted, loads add its
+        # entries of each kind whose file has not been replaced yet, so a
+        # crash at any point neither loses the log nor applies it twice.
+        self._set_log_aside(username)
+        super().save_entries(username, income_entries, expense_entries)
+        self._drop_folded(username)
+
+    def _set_log_aside(self, username):
+        folded_log, folded_meta = get_folded_log_filenames(username)
+        if os.path.exists(folded_log):
+            # Finish the fold a crash interrupted before starting another.
+            income, expense = self._load_folded(username)
+            JsonStorage.save_entries(self, username, income, expense)
+            self._drop_folded(username)
+        log_file = get_log_filename(username)
+        if os.path.exists(log_file):
+            # The snapshot's log offset refers to the log being moved.
+            _remove(get_snapshot_filename(username))
+            _write_json(folded_meta, {"base": _file_identities(get_data_filenames(username)[:2])})
+            os.replace(log_file, folded_log)
+
+    def _drop_folded(self, username):
+        for path in get_folded_log_filenames(username):
+            _remove(path)
+
+    def append_entries(self, username, income_entries=(), expense_entries=()):
+        lines = [json.dumps({"kind": "income", "entry": e}) + "\n" for e in income_entries]
+        lines += [json.dumps({"kind": "expense", "entry": e}) + "\n" for e in expense_entries]
+        if not lines:
+            return
+        if _append_lines(get_log_filename(username), lines) >= LOG_COMPACT_BYTES:
+            self.compact(username)
+
+    def data_signature(self, username):
+        return super().data_signature(username) + _stat_signature(
+            [get_log_filename(username), get_folded_log_filenames(username)[0]])
+
+    def compact(self, username):
+        income, expense = self.load_entries(username)
+        self.save_entries(username, income, expense)
+
+    def delete_user(self, username):
+        log_file = get_log_filename(username)
+        if os.path.exists(log_file):
+            os.remove(log_file)
+        self._drop_folded(username)
+        super().delete_user(username)
+
+    def _read_log(self, username, offset=0, path=None):
+        # Returns ([(kind, entry)], end offset) for the log (or the log file
+        # at path) from byte offset on, or (None, offset) if the log is
+        # shorter than that. The end offset stops after the last complete
+        # line, so a line still being appended is read in full next time.
+        records, end = [], offset
+        try:
+            f = open(path or get_log_filename(username), "rb")
+        except FileNotFoundError:
+            return (records, end) if offset == 0 else (None, offset)
+        with f:
+            if offset > os.fstat(f.fileno()).st_size:
+                return None, offset
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                end += len(line)
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A log written before _append_lines cut off torn
+                    # tails may still hold a glued line.
+                    continue
+                records.append((record["kind"], record["entry"]))
+        metrics.record_bytes_read(end - offset)
+        return records, end
+
+
+class SqliteStorage:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            password_hash TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS entries (
+            id INTEGER PRIMARY KEY,
+            user TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            date TEXT,
+            category TEXT,
+            amount REAL NOT NULL,
+            body TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS entries_user_date ON entries (user, date);
+        CREATE INDEX IF NOT EXISTS entries_user_category ON entries (user, category);
+        CREATE TABLE IF NOT EXISTS docs (
+            user TEXT NOT NULL,
+            name TEXT NOT NULL,
+            body TEXT NOT NULL,
+            PRIMARY KEY (user, name)
+        );
+        CREATE TABLE IF NOT EXISTS versions (
+            user TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS changes (
+            user TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            body TEXT NOT NULL,
+            PRIMARY KEY (user, seq)
+        );
+    """
+
+    # versions holds a write counter per user, bumped in the same
+    # transaction as every entry write; the empty user name tracks the
+    # users table.
+
+    def __init__(self, path=None):
+        self.path = path or SQLITE_PATH
+        self._local = threading.local()
+        self._connect().executescript(self.SCHEMA)
+
+    def _connect(self):
+        # sqlite3 connections must not be shared across threads, so each
+        # request thread gets its own.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load_users(self):
+        rows = self._connect().execute("SELECT username, password_hash FROM users")
+        return dict(rows.fetchall())
+
+    def save_users(self, users):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM users")
+            conn.executemany("INSERT INTO users (username, password_hash) VALUES (?, ?)", users.items())
+            self._bump_version(conn, "")
+
+    def users_signature(self):
+        return self.data_signature("")
+
+    def data_signature(self, username):
+        row = self._connect().execute("SELECT version FROM versions WHERE user = ?", (username,)).fetchone()
+        return row[0] if row else 0
+
+    def changes_signature(self, username):
+        # The change log is only written together with a version bump.
+        return self.data_signature(username)
+
+    def _bump_version(self, conn, username):
+        conn.execute(
+            "INSERT INTO versions (user, version) VALUES (?, 1) "
+            "ON CONFLICT (user) DO UPDATE SET version = version + 1", (username,))
+
+    def load_entries(self, username):
+        income, expense = [], []
+        nbytes = 0
+        rows = self._connect().execute(
+            "SELECT kind, body FROM entries WHERE user = ? ORDER BY id", (username,))
+        for kind, body in rows:
+            (income if kind == "income" else expense).append(json.loads(body))
+            nbytes += len(body)
+        metrics.record_bytes_read(nbytes)
+        return income, expense
+
+    def load_ledger(self, username):
+        # Rows are indexed per user already, so there is no snapshot here.
+        income, expense = self.load_entries(username)
+        return from_dicts("income", income), from_dicts("expense", expense)
+
+    def save_entries(self, username, income_entries, expense_entries):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries WHERE user = ?", (username,))
+            self._insert(conn, username, income_entries, expense_entries)
+            self._bump_version(conn, username)
+
+    def append_entries(self, username, income_entries=(), expense_entries=()):
+        with self._connect() as conn:
+            self._insert(conn, username, income_entries, expense_entries)
+            self._bump_version(conn, username)
+
+    def _insert(self, conn, username, income_entries, expense_entries):
+        # Undated entries index as "" so they sort after everything else in
+        # newest-first listings instead of needing NULL handling.
+        rows = [(username, "income", e.get("date") or "", None, e["amount"], json.dumps(e)) for e in income_entries]
+        rows += [(username, "expense", e.get("date") or "", e.get("category", "Other"), e["amount"], json.dumps(e))
+                 for e in expense_entries]
+        conn.executemany(
+            "INSERT INTO entries (user, kind, date, category, amount, body) VALUES (?, ?, ?, ?, ?, ?)", rows)
+        metrics.record_bytes_written(sum(len(row[-1]) for row in rows))
+
+    def query_entries(self, username, start=None, end=None, category=None, after=None, limit=50):
+        # Keyset pagination over the (user, date) index, newest first; the
+        # cursor is the (date, id) of the last row already returned.
+        sql = "SELECT id, kind, date, body FROM entries WHERE user = ?"
+        params = [username]
+        if start is not None:
+            sql += " AND date >= ?"
+            params.append(start)
+        if end is not None:
+            sql += " AND date <= ?"
+            params.append(end)
+        if category is not None:
+            sql += " AND kind = 'expense' AND category = ?"
+            params.append(category)
+        if after is not None:
+            sql += " AND (date < ? OR (date = ? AND id < ?))"
+            params += [after[0], after[0], after[1]]
+        sql += " ORDER BY date DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
+        rows = self._connect().execute(sql, params).fetchall()
+        metrics.record_entries_scanned(len(rows))
+        metrics.record_bytes_read(sum(len(row[3]) for row in rows))
+        items = [dict(json.loads(body), id=row_id, kind=kind) for row_id, kind, _, body in rows[:limit]]
+        next_key = [rows[limit - 1][2], rows[limit - 1][0]] if len(rows) > limit else None
+        return items, next_key
+
+    def write_batch(self, username, income_entries, expense_entries, docs, changes=()):
+        with self._connect() as conn:
+            self._insert(conn, username, income_entries, expense_entries)
+            self._insert_changes(conn, username, changes)
+            rows = [(username, name, json.dumps(value)) for name, value in docs.items()]
+            conn.executemany("INSERT OR REPLACE INTO docs (user, name, body) VALUES (?, ?, ?)", rows)
+            metrics.record_bytes_written(sum(len(row[2]) for row in rows))
+            self._bump_version(conn, username)
+
+    def load_changes(self, username, seq):
+        rows = self._connect().execute(
+            "SELECT body FROM changes WHERE user = ? AND seq <= ? ORDER BY seq DESC LIMIT ?",
+            (username, seq, CHANGE_LOG_LIMIT)).fetchall()
+        metrics.record_bytes_read(sum(len(row[0]) for row in rows))
+        return [json.loads(row[0]) for row in reversed(rows)]
+
+    def append_changes(self, username, changes):
+        with self._connect() as conn:
+            self._insert_changes(conn, username, changes)
+
+    def _insert_changes(self, conn, username, changes):
+        if not changes:
+            return
+        rows = [(username, change["seq"], json.dumps(change)) for change in changes]
+        conn.executemany("INSERT OR REPLACE INTO changes (user, seq, body) VALUES (?, ?, ?)", rows)
+        conn.execute("DELETE FROM changes WHERE user = ? AND seq <= ?",
+                     (username, changes[-1]["seq"] - CHANGE_LOG_LIMIT))
+        metrics.record_bytes_written(sum(len(row[2]) for row in rows))
+
+    def load_doc(self, username, name, default=None):
+        row = self._connect().execute(
+            "SELECT body FROM docs WHERE user = ? AND name = ?", (username, name)).fetchone()
+        if row is None:
+            return default
+        metrics.record_bytes_read(len(row[0]))
+        return json.loads(row[0])
+
+    def save_doc(self, username, name, value):
+        body = json.dumps(value)
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO docs (user, name, body) VALUES (?, ?, ?)", (username, name, body))
+        metrics.record_bytes_written(len(body))
+
+    def load_shared_doc(self, name, default=None):
+        return self.load_doc("", name, default)
+
+    def save_shared_doc(self, name, value):
+        self.save_doc("", name, value)
+
+    def delete_user(self, username):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries WHERE user = ?", (username,))
+            conn.execute("DELETE FROM docs WHERE user = ?", (username,))
+            conn.execute("DELETE FROM changes WHERE user = ?", (username,))
+            self._bump_version(conn, username)
+
+
+STORAGE_MODES = {
+    "json": JsonStorage,
+    "log": LogStorage,
+    "sqlite": SqliteStorage,
+}
+
+_storage = None
+_cache = LRUCache(CACHE_MAX_USERS, CACHE_MAX_BYTES)
+# Bumped on every write made through this module, so the cache stays
+# correct even when a write lands within the filesystem's mtime resolution.
+_write_versions = {}
+
+
+def get_storage():
+    global _storage
+    if _storage is None:
+        if STORAGE_MODE not in STORAGE_MODES:
+            raise ValueError(f"Unknown storage mode: {STORAGE_MODE}")
+        _storage = STORAGE_MODES[STORAGE_MODE]()
+    return _storage
+
+
+def _signature(key, backend_signature):
+    return (_write_versions.get(key, 0), backend_signature)
+
+
+def _invalidate(key):
+    _write_versions[key] = _write_versions.get(key, 0) + 1
+    _cache.discard(key)
+
+
+@metrics.instrumented("load_users")
+def load_users():
+    backend = get_storage()
+    signature = _signature(("users",), backend.users_signature())
+    users = _cache.get(("users",), signature)
+    if users is None:
+        users = backend.load_users()
+        _cache.put(("users",), signature, users, estimate_size(users))
+    return dict(users)
+
+
+@metrics.instrumented("save_users")
+def save_users(users):
+    with users_table_lock():
+        get_storage().save_users(users)
+        _invalidate(("users",))
+
+
+@metrics.instrumented("load_data")
+def load_data(username):
+    # Returns lists of entries.Entry. Callers get fresh lists but share the
+    # cached entries, which must be treated as read-only.
+    backend = get_storage()
+    key = ("ledger", username)
+    signature = _signature(key, backend.data_signature(username))
+    ledger = _cache.get(key, signature)
+    if ledger is None:
+        ledger = backend.load_ledger(username)
+        metrics.record_entries_scanned(len(ledger[0]) + len(ledger[1]))
+        _cache.put(key, signature, ledger, estimate_entries_size(ledger[0]) + estimate_entries_size(ledger[1]))
+    return list(ledger[0]), list(ledger[1])
+
+
+def _date_index(username):
+    # Every entry's (date, kind, position) sorted ascending, built once per
+    # ledger version and cached next to it so each page is a bisect plus a
+    # short walk rather than a sort of the whole history.
+    backend = get_storage()
+    key = ("date_index", username)
+    signature = _signature(("ledger", username), backend.data_signature(username))
+    cached = _cache.get(key, signature)
+    if cached is None:
+        income, expense = load_data(username)
+        index = [(e.date or "", "income", i) for i, e in enumerate(income)]
+        index += [(e.date or "", "expense", i) for i, e in enumerate(expense)]
+        index.sort()
+        cached = (index, income, expense)
+        _cache.put(key, signature, cached, 120 * len(index))
+    return cached
+
+
+@metrics.instrumented("query_entries")
+def query_entries(username, start=None, end=None, category=None, cursor=None, limit=50):
+    # Returns (entries, next_cursor), newest first. next_cursor is None on
+    # the last page; pass it back unchanged to get the following page.
+    backend = get_storage()
+    keyed_by_id = hasattr(backend, "query_entries")
+    after = _decode_cursor(cursor, keyed_by_id) if cursor else None
+    if keyed_by_id:
+        items, next_key = backend.query_entries(username, start, end, category, after, limit)
+        return items, _encode_cursor(next_key) if next_key else None
+
+    index, income, expense = _date_index(username)
+    if after is not None:
+        position = bisect.bisect_left(index, tuple(after))
+    elif end is not None:
+        position = bisect.bisect_right(index, (end, "~"))
+    else:
+        position = len(index)
+
+    items = []
+    first = position
+    while position > 0 and len(items) <= limit:
+        position -= 1
+        date, kind, i = index[position]
+        if end is not None and date > end:
+            continue
+        if start is not None and date < start:
+            break
+        entry = income[i] if kind == "income" else expense[i]
+        if category is not None and entry.category != category:
+            continue
+        items.append((index[position], dict(entry.to_dict(), id=f"{kind}-{i}", kind=kind)))
+
+    metrics.record_entries_scanned(first - position)
+    next_cursor = _encode_cursor(list(items[limit - 1][0])) if len(items) > limit else None
+    return [item for _, item in items[:limit]], next_cursor
+
+
+def _encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def _decode_cursor(cursor, keyed_by_id):
+    # Backends with query_entries page by [date, row id], the date index by
+    # [date, kind, position]; a cursor of the wrong shape is rejected here
+    # rather than failing (or repeating rows) in the comparison.
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        key = None
+    if keyed_by_id:
+        valid = isinstance(key, list) and len(key) == 2 and _is_index(key[1])
+    else:
+        valid = isinstance(key, list) and len(key) == 3 and key[1] in ("income", "expense") and _is_index(key[2])
+    if not valid or not isinstance(key[0], str):
+        raise ValueError("Invalid cursor.")
+    return key
+
+
+def _is_index(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def cache_stats():
+    return _cache.stats()
+
+
+@metrics.instrumented("save_data")
+def save_data(username, income_entries, expense_entries):
+    income_entries, expense_entries = to_dicts(income_entries), to_dicts(expense_entries)
+    with user_lock(username):
+        backend = get_storage()
+        # Documents first: the entry write bumps the SQLite version that
+        # readers of the change log revalidate against.
+        seq_doc, records = _record_changes(username, [{"type": "reset"}])
+        backend.append_changes(username, records)
+        backend.save_doc(username, "changes", seq_doc)
+        backend.save_doc(username, "aggregates", build_aggregates(income_entries, expense_entries))
+        backend.save_entries(username, income_entries, expense_entries)
+        _invalidate(("ledger", username))
+        _invalidate(("changes", username))
+
+
+class _PendingAppend:
+    def __init__(self):
+        self.income = []
+        self.expense = []
+        self.error = None
+        self.done = threading.Event()
+
+
+_pending = {}
+_pending_guard = threading.Lock()
+
+
+@metrics.instrumented("append_entries")
+def append_entries(username, income_entries=(), expense_entries=()):
+    if not GROUP_COMMIT:
+        with user_lock(username):
+            _commit_append(username, income_entries, expense_entries)
+        return
+
+    with _pending_guard:
+        batch = _pending.get(username)
+        if batch is None:
+            batch = _pending[username] = _PendingAppend()
+        batch.income.extend(income_entries)
+        batch.expense.extend(expense_entries)
+
+    # Whoever gets the lock first commits everything queued so far; the
+    # others find their batch already taken and just wait for it.
+    with user_lock(username):
+        with _pending_guard:
+            is_leader = _pending.get(username) is batch
+            if is_leader:
+                del _pending[username]
+        if is_leader:
+            try:
+                _commit_append(username, batch.income, batch.expense)
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+    batch.done.wait()
+    if batch.error is not None:
+        raise batch.error
+
+
+def _commit_append(username, income_entries, expense_entries, docs=None, changes=()):
+    # Entries, the updated aggregates, the change log and any other
+    # documents go to the backend as one batch (a single transaction on
+    # SQLite).
+    backend = get_storage()
+    aggregates = _stored_aggregates(username)
+    if aggregates is None:
+        aggregates = build_aggregates(*load_data(username))
+    apply_entries(aggregates, income_entries, expense_entries)
+    changes = [{"type": "income", "entry": e} for e in income_entries] + \
+        [{"type": "expense", "entry": e} for e in expense_entries] + list(changes)
+    seq_doc, records = _record_changes(username, changes)
+    docs = dict(docs or {}, aggregates=aggregates, changes=seq_doc)
+    backend.write_batch(username, income_entries, expense_entries, docs, records)
+    _invalidate(("ledger", username))
+    _invalidate(("changes", username))
+
+
+@metrics.instrumented("apply_batch")
+def apply_batch(username, income_entries=(), expense_entries=(), budget_updates=None):
+    # Commits entries and budget changes together under one lock.
+    with user_lock(username):
+        docs, changes = {}, []
+        if budget_updates:
+            docs["budgets"] = dict(load_budgets(username), **budget_updates)
+            changes = _budget_changes(budget_updates)
+        _commit_append(username, income_entries, expense_entries, docs, changes)
+
+
+def _budget_changes(budgets):
+    return [{"type": "budget", "category": category, "amount": amount} for category, amount in budgets.items()]
+
+
+def _record_changes(username, changes):
+    # Numbers `changes` after the user's latest change. Returns the updated
+    # "changes" document and the numbered changes; callers hold the user
+    # lock and write both, the changes first.
+    seq = _stored_change_seq(username)
+    records = []
+    for change in changes:
+        seq += 1
+        records.append(dict(change, seq=seq))
+    return {"seq": seq}, records
+
+
+def _stored_change_seq(username):
+    return (get_storage().load_doc(username, "changes") or {}).get("seq", 0)
+
+
+@metrics.instrumented("load_changes")
+def load_changes(username):
+    backend = get_storage()
+    key = ("changes", username)
+    signature = _signature(key, backend.changes_signature(username))
+    log = _cache.get(key, signature)
+    if log is None:
+        seq = _stored_change_seq(username)
+        log = {"seq": seq, "changes": backend.load_changes(username, seq)}
+        _cache.put(key, signature, log, estimate_size(log["changes"]))
+    return {"seq": log["seq"], "changes": list(log["changes"])}
+
+
+@metrics.instrumented("change_seq")
+def change_seq(username):
+    # Cached under the change log's signature, so an unchanged sequence
+    # costs a stat (one indexed row on SQLite) rather than a read.
+    backend = get_storage()
+    key = ("change_seq", username)
+    signature = _signature(("changes", username), backend.changes_signature(username))
+    seq = _cache.get(key, signature)
+    if seq is None:
+        seq = _stored_change_seq(username)
+        _cache.put(key, signature, seq, 64)
+    return seq
+
+
+def data_version(username):
+    # Changes with every write to the user's entries or budgets (each one
+    # records a change), and is read without loading anything, for
+    # memoizing results derived from their data.
+    return _signature(("changes", username), get_storage().changes_signature(username))
+
+
+@metrics.instrumented("changes_since")
+def changes_since(username, since):
+    # Returns (seq, changes, reset). reset is True when `since` is older
+    # than the retained log (or from another history) and the client has
+    # to refetch everything.
+    log = load_changes(username)
+    seq, changes = log["seq"], log["changes"]
+    oldest = changes[0]["seq"] if changes else seq + 1
+    if since > seq or since < oldest - 1:
+        return seq, [], True
+    pending = [change for change in changes if change["seq"] > since]
+    return seq, pending, any(change["type"] == "reset" for change in pending)
+
+
+def _stored_aggregates(username):
+    # None when missing or written under an older AGGREGATES_SCHEMA.
+    aggregates = get_storage().load_doc(username, "aggregates")
+    if aggregates is None or aggregates.get("schema") != AGGREGATES_SCHEMA:
+        return None
+    return aggregates
+
+
+@metrics.instrumented("load_aggregates")
+def load_aggregates(username):
+    aggregates = _stored_aggregates(username)
+    if aggregates is None:
+        aggregates = rebuild_aggregates(username)
+    return aggregates
+
+
+@metrics.instrumented("rebuild_aggregates")
+def rebuild_aggregates(username):
+    with user_lock(username):
+        aggregates = build_aggregates(*load_data(username))
+        get_storage().save_doc(username, "aggregates", aggregates)
+        return aggregates
+
+
+@metrics.instrumented("load_budgets")
+def load_budgets(username):
+    return get_storage().load_doc(username, "budgets", {})
+
+
+@metrics.instrumented("save_budgets")
+def save_budgets(username, budgets):
+    with user_lock(username):
+        previous = load_budgets(username)
+        updated = {category: amount for category, amount in budgets.items() if previous.get(category) != amount}
+        removed = {category: None for category in previous if category not in budgets}
+        _commit_append(username, (), (), {"budgets": budgets}, _budget_changes(dict(updated, **removed)))
+
+
+@metrics.instrumented("load_category_rules")
+def load_category_rules(username):
+    return get_storage().load_doc(username, "category_rules", {})
+
+
+@metrics.instrumented("save_category_rules")
+def save_category_rules(username, rules):
+    with user_lock(username):
+        get_storage().save_doc(username, "category_rules", rules)
+
+
+@metrics.instrumented("load_category_memo")
+def load_category_memo(username):
+    return get_storage().load_doc(username, "category_memo", {})
+
+
+@metrics.instrumented("save_category_memo")
+def save_category_memo(username, memo):
+    with user_lock(username):
+        get_storage().save_doc(username, "category_memo", memo)
+
+
+@metrics.instrumented("load_recurring_rules")
+def load_recurring_rules(username):
+    return get_storage().load_doc(username, "recurring", {})
+
+
+@metrics.instrumented("save_recurring_rules")
+def save_recurring_rules(username, rules):
+    with user_lock(username):
+        get_storage().save_doc(username, "recurring", rules)
+
+
+@metrics.instrumented("append_recurring")
+def append_recurring(username, income_entries, expense_entries, rules):
+    # Generated entries go in the same batch as the rules' new positions.
+    # On SQLite that is one transaction, so a crash cannot leave an
+    # occurrence written but still due. File backends write the entries
+    # before the documents (see JsonStorage.write_batch): a crash in between
+    # leaves the batch's occurrences due, and they are written again; the
+    # rule id in each entry's "recurring" field identifies such duplicates.
+    with user_lock(username):
+        _commit_append(username, income_entries, expense_entries, {"recurring": rules})
+
+
+@metrics.instrumented("load_recurring_schedule")
+def load_recurring_schedule():
+    return get_storage().load_shared_doc(SCHEDULE_DOC, {})
+
+
+@metrics.instrumented("save_recurring_schedule")
+def save_recurring_schedule(schedule):
+    get_storage().save_shared_doc(SCHEDULE_DOC, schedule)
+
+
+@metrics.instrumented("delete_user_data")
+def delete_user_data(username):
+    with user_lock(username):
+        get_storage().delete_user(username)
+        _invalidate(("ledger", username))
+        _invalidate(("changes", username))
+
+
+@metrics.instrumented("compact_log")
+def compact_log(username):
+    # Also the migration path away from log mode: afterwards the JSON files
+    # hold the full ledger and the log is gone.
+    with user_lock(username):
+        LogStorage().compact(username)
+        _invalidate(("ledger", username))
+
+
+def import_json_files(target=None, usernames=None):
+    # Copies users.json and each user's income/expense/budget/recurring
+    # files, category rules and learned categories (plus any unfolded
+    # ledger log) into another backend, the SQLite one by default. Returns
+    # the number of users imported.
+    source = LogStorage()
+    target = target or SqliteStorage()
+    users = source.load_users()
+    if usernames is None:
+        usernames = list(users)
+    merged = target.load_users()
+    for username in usernames:
+        if username in users:
+            merged[username] = users[username]
+        income, expense = source.load_entries(username)
+        target.save_entries(username, income, expense)
+        target.save_doc(username, "budgets", source.load_doc(username, "budgets", {}))
+        target.save_doc(username, "recurring", source.load_doc(username, "recurring", {}))
+        target.save_doc(username, "category_rules", source.load_doc(username, "category_rules", {}))
+        target.save_doc(username, "category_memo", source.load_doc(username, "category_memo", {}))
+        target.save_doc(username, "aggregates", build_aggregates(income, expense))
+    schedule = source.load_shared_doc(SCHEDULE_DOC, {})
+    merged_schedule = target.load_shared_doc(SCHEDULE_DOC, {})
+    merged_schedule.update((username, schedule[username]) for username in usernames if username in schedule)
+    target.save_shared_doc(SCHEDULE_DOC, merged_schedule)
+    target.save_users(merged)
+    return len(usernames)
+
+
+def _link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def _legacy_usernames():
+    suffixes = tuple(f"_{name}" for name in USER_FILES)
+    usernames = set()
+    for entry in os.scandir(LEGACY_DATA_DIR):
+        for suffix in suffixes:
+            if entry.name.endswith(suffix) and len(entry.name) > len(suffix):
+                usernames.add(entry.name[:-len(suffix)])
+                break
+    return usernames
+
+
+def migrate_users_file():
+    # Returns the flat-layout path left to delete, if any.
+    legacy = os.path.join(LEGACY_DATA_DIR, USERS_FILENAME)
+    path = os.path.join(DATA_DIR, USERS_FILENAME)
+    if os.path.abspath(legacy) == os.path.abspath(path):
+        return []
+    with users_table_lock():
+        if not os.path.exists(legacy):
+            return []
+        if not os.path.exists(path):
+            os.makedirs(DATA_DIR, exist_ok=True)
+            tmp_path = path + ".migrating"
+            _link_or_copy(legacy, tmp_path)
+            os.replace(tmp_path, path)
+        return [legacy]
+
+
+def migrate_user_files(username):
+    # Moves one user's flat-layout files into their sharded directory and
+    # returns the flat paths left to delete. The files are hard-linked (or
+    # copied) into a staging directory which is then renamed into place, so
+    # the switch is atomic. Writers are held off by the user lock; readers
+    # that resolved a flat path just before the switch still find the same
+    # data there until the caller deletes it.
+    with user_lock(username):
+        legacy = [name for name in USER_FILES if os.path.exists(_legacy_path(username, name))]
+        target = get_user_dir(username)
+        if legacy and not os.path.isdir(target):
+            parent, name = os.path.split(target)
+            # Encoded names never start with a dot, so this cannot clash.
+            staging = os.path.join(parent, f".{name}.migrating")
+            shutil.rmtree(staging, ignore_errors=True)
+            os.makedirs(staging)
+            for filename in legacy:
+                _link_or_copy(_legacy_path(username, filename), os.path.join(staging, filename))
+            os.rename(staging, target)
+            _sharded_users.add(username)
+        return [_legacy_path(username, filename) for filename in legacy]
+
+
+def migrate_layout(usernames=None, grace=MIGRATION_GRACE_SECONDS):
+    # Moves users.json and every user's files from the flat layout into
+    # DATA_DIR while the app keeps running. By default migrates every user
+    # with flat files or an account. Returns the number of users moved.
+    if usernames is None:
+        usernames = sorted(_legacy_usernames() | set(load_users()))
+    leftovers = migrate_users_file()
+    migrated = 0
+    for username in usernames:
+        paths = migrate_user_files(username)
+        migrated += bool(paths)
+        leftovers += paths
+    if leftovers:
+        time.sleep(grace)
+        for path in leftovers:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    return migrated
+
+
+if __name__ == "__main__":
+    print(f"Imported {import_json_files()} user(s) into {SQLITE_PATH}")
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import locking  # noqa: E402
+import storage  # noqa: E402
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    # Points every file backend and lock at a fresh directory.
+    monkeypatch.setattr(storage, "DATA_DIR", str(tmp_path / "data"))
+    monkeypatch.setattr(storage, "LEGACY_DATA_DIR", str(tmp_path))
+    monkeypatch.setattr(locking, "LOCK_DIR", str(tmp_path / ".locks"))
+    monkeypatch.setattr(storage, "_sharded_users", set())
+    return tmp_path
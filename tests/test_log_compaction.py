@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+import storage
+
+
+class Crash(Exception):
+    pass
+
+
+def _entries(count):
+    income = [{"source": f"salary {i}", "amount": 100.0 + i, "date": f"2024-01-{i + 1:02d}"} for i in range(count)]
+    expense = [{"category": "Food", "amount": 5.0 + i, "description": f"lunch {i}", "date": f"2024-01-{i + 1:02d}"}
+               for i in range(count)]
+    return income, expense
+
+
+def _crash_at(monkeypatch, step):
+    # Makes the step-th file write or removal (counting from 0) raise Crash
+    # before it happens, as if the process died there.
+    calls = {"count": 0}
+
+    def wrap(function):
+        def wrapper(*args):
+            if calls["count"] == step:
+                raise Crash
+            calls["count"] += 1
+            return function(*args)
+        return wrapper
+
+    monkeypatch.setattr(storage, "_write_json", wrap(storage._write_json))
+    monkeypatch.setattr(storage, "_remove", wrap(storage._remove))
+
+
+@pytest.mark.parametrize("step", range(8))
+def test_crash_during_compaction_neither_loses_nor_repeats_the_log(data_dir, monkeypatch, step):
+    backend = storage.LogStorage()
+    base_income, base_expense = _entries(2)
+    backend.save_entries("alice", base_income, base_expense)
+    log_income, log_expense = _entries(4)
+    backend.append_entries("alice", log_income[2:], log_expense[2:])
+    expected = backend.load_entries("alice")
+
+    with monkeypatch.context() as patch:
+        _crash_at(patch, step)
+        try:
+            backend.compact("alice")
+        except Crash:
+            pass
+
+    restarted = storage.LogStorage()
+    assert restarted.load_entries("alice") == expected
+    income, expense = restarted.load_ledger("alice")
+    assert [e.to_dict() for e in income] == expected[0]
+    assert [e.to_dict() for e in expense] == expected[1]
+
+    extra_income, _ = _entries(5)
+    restarted.append_entries("alice", extra_income[4:])
+    restarted.compact("alice")
+    assert restarted.load_entries("alice") == (expected[0] + extra_income[4:], expected[1])
+    assert not any(os.path.exists(path) for path in storage.get_folded_log_filenames("alice"))
+    assert not os.path.exists(storage.get_log_filename("alice"))